@@ -0,0 +1,495 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load-test the webui against a stub core, in-process and through each server
+adapter over loopback, reporting throughput, latency and peak memory.
+
+The webui must be installed in a pyLoad package, which provides the modules
+of the core it imports; the core itself is not started. Results depend on the
+machine and its load, compare runs made on the same one.
+
+Every target runs in its own process, so the peak RSS is its own:
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --targets inprocess --scenarios call_api,login
+    python benchmarks/run.py --output new.json --compare results.json
+"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from builtins import int, object, range, str
+
+from future import standard_library
+
+standard_library.install_aliases()
+
+import http.client  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+timer = getattr(time, 'perf_counter', time.time)
+
+INPROCESS = 'inprocess'
+
+# name: (method, path, form body, authenticated)
+SCENARIOS = {
+    'call_api': ('GET', "/api/get_status_info", None, True),
+    'call_api_tree': ('GET', "/api/get_file_tree/-1/true", None, True),
+    'login': ('POST', "/api/login", "username=bench&password=bench", False),
+    'serve_static': ('GET', "/scripts/app.js", None, False),
+    'index': ('GET', "/", None, False),
+    'download': ('GET', "/download/1", None, True),
+}
+ORDER = ['call_api', 'call_api_tree', 'login', 'serve_static', 'index',
+         'download']
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def peak_rss():
+    """
+    :return: peak resident memory of this process in bytes
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but on macOS
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class InProcessClient(object):
+    """
+    Call the wsgi application directly, measuring the webui alone
+    """
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, body=None, headers=None):
+        path, _, query = path.partition("?")
+        body = body.encode('utf-8') if body else b""
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': "",
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_LENGTH': str(len(body)),
+            'SERVER_NAME': "localhost",
+            'SERVER_PORT': "80",
+            'SERVER_PROTOCOL': "HTTP/1.1",
+            'REMOTE_ADDR': "127.0.0.1",
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': "http",
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in (headers or {}).items():
+            key = name.upper().replace("-", "_")
+            if key != 'CONTENT_TYPE':
+                key = "HTTP_" + key
+            environ[key] = value
+
+        status = []
+
+        def start_response(line, response_headers, exc_info=None):
+            status[:] = [line, response_headers]
+            return lambda data: None
+
+        result = self.app(environ, start_response)
+        size = 0
+        try:
+            for chunk in result:
+                size += len(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return int(status[0].split()[0]), dict(status[1]), size
+
+    def close(self):
+        pass
+
+
+class HTTPClient(object):
+    """
+    Keep-alive connection to the server on loopback
+    """
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(
+                    "127.0.0.1", self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body, headers or {})
+                resp = self.conn.getresponse()
+                size = len(resp.read())
+                break
+            except (http.client.HTTPException, socket.error):
+                # the server closed the connection, retry once on a new one
+                self.close()
+                if attempt:
+                    raise
+        if resp.getheader('Connection', "").lower() == 'close':
+            self.close()
+        return resp.status, dict(resp.getheaders()), size
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def login(client):
+    """
+    :return: session cookie of the stub user
+    """
+    status, headers, _ = client.request(
+        'POST', "/api/login", "username=bench&password=bench",
+        {'Content-Type': "application/x-www-form-urlencoded"})
+    cookie = headers.get('Set-Cookie') or headers.get('set-cookie')
+    if status != 200 or not cookie:
+        raise Exception("Login failed with status {0:d}".format(status))
+    return cookie.split(";", 1)[0]
+
+
+def run_scenario(clients, scenario, requests, cookie, encoding):
+    """
+    Send `requests` requests from all the `clients` at once
+
+    :return: dict of the measured values
+    """
+    method, path, body, authenticated = SCENARIOS[scenario]
+    headers = {}
+    if body:
+        headers['Content-Type'] = "application/x-www-form-urlencoded"
+    if authenticated:
+        headers['Cookie'] = cookie
+    if encoding:
+        headers['Accept-Encoding'] = encoding
+
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    transferred = [0]
+
+    def work(client):
+        local = []
+        while next(counter) < requests:
+            start = timer()
+            try:
+                status, _, size = client.request(method, path, body, headers)
+            except Exception:
+                status, size = 0, 0
+            local.append(timer() - start)
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                transferred[0] += size
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=work, args=(client,))
+               for client in clients]
+    start = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timer() - start
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items()
+                 if not 200 <= status < 400)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': dict((str(k), v) for k, v in statuses.items()),
+        'seconds': elapsed,
+        'rps': len(latencies) / elapsed if elapsed else None,
+        'p50': percentile(latencies, 0.50),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else None,
+        'bytes': transferred[0],
+        'peak_rss': peak_rss(),
+    }
+
+
+def free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def start_adapter(adapter, app, port, connections, timeout=10):
+    """
+    Serve `app` with `adapter` in a background thread, wait until it accepts
+    """
+    server = adapter("127.0.0.1", port, None, None, connections, False)
+    server.quiet = True
+    failure = []
+
+    def serve():
+        try:
+            # event loop based servers need one in their thread
+            import asyncio
+            asyncio.set_event_loop(asyncio.new_event_loop())
+        except ImportError:
+            pass
+        try:
+            server.run(app)
+        except BaseException as e:
+            failure.append(e)
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if failure:
+            raise failure[0]
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise Exception("{0} did not start listening".format(adapter.NAME))
+
+
+def run_target(options):
+    """
+    Benchmark a single target in this process
+    """
+    sys.path.insert(0, HERE)
+    import stubcore
+
+    core = stubcore.StubCore(options.files, options.download_size << 20)
+    stubcore.install(core)
+
+    from pyload.webui import iface
+    from pyload.webui.servers import all_server
+
+    result = {'target': options.worker, 'scenarios': {}}
+    if options.worker == INPROCESS:
+        def make_client():
+            return InProcessClient(iface.web)
+    else:
+        adapter = dict((server.NAME, server) for server in all_server).get(
+            options.worker)
+        if adapter is None or not adapter.find():
+            result['error'] = "Not available"
+            return result
+        port = free_port()
+        try:
+            start_adapter(adapter, iface.web, port, options.connections)
+        except Exception as e:
+            result['error'] = str(e)
+            return result
+        iface.load.capacity = options.connections
+
+        def make_client():
+            return HTTPClient(port)
+
+    clients = [make_client() for _ in range(options.clients)]
+    cookie = login(clients[0])
+    for scenario in options.scenarios:
+        # warm up caches and connections, not measured
+        run_scenario(clients, scenario, options.warmup, cookie,
+                     options.encoding)
+        result['scenarios'][scenario] = run_scenario(
+            clients, scenario, options.requests, cookie, options.encoding)
+    for client in clients:
+        client.close()
+    result['peak_rss'] = peak_rss()
+    return result
+
+
+def spawn_target(target, options):
+    """
+    Run the benchmark of `target` in a child process
+    """
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    args = [sys.executable, os.path.abspath(__file__),
+            '--worker', target, '--output', path,
+            '--scenarios', ",".join(options.scenarios),
+            '--clients', str(options.clients),
+            '--connections', str(options.connections),
+            '--requests', str(options.requests),
+            '--warmup', str(options.warmup),
+            '--files', str(options.files),
+            '--download-size', str(options.download_size),
+            '--encoding', options.encoding]
+    try:
+        code = subprocess.call(args, cwd=options.workdir)
+        if code:
+            return {'target': target,
+                    'error': "Exited with code {0:d}".format(code)}
+        with io.open(path, encoding='utf-8') as fp:
+            return json.load(fp)
+    finally:
+        os.remove(path)
+
+
+def get_version():
+    try:
+        with io.open(os.path.join(ROOT, 'VERSION'), encoding='utf-8') as fp:
+            return fp.read().strip()
+    except IOError:
+        return None
+
+
+def format_ms(value):
+    return "-" if value is None else "{0:.2f}".format(value * 1000)
+
+
+def report(results, baseline=None):
+    """
+    Print a table of the results, compared to `baseline` if given
+    """
+    before = {}
+    for target in (baseline or {}).get('targets', []):
+        for scenario, values in target.get('scenarios', {}).items():
+            before[(target['target'], scenario)] = values
+
+    print("{0:<12} {1:<14} {2:>10} {3:>9} {4:>9} {5:>7} {6:>9} {7:>8}".format(
+        "target", "scenario", "req/s", "p50 ms", "p99 ms", "errors",
+        "rss MiB", "change"))
+    for target in results['targets']:
+        if 'error' in target:
+            print("{0:<12} {1}".format(target['target'], target['error']))
+            continue
+        for scenario in ORDER:
+            values = target['scenarios'].get(scenario)
+            if values is None:
+                continue
+            change = ""
+            old = before.get((target['target'], scenario))
+            if old and old.get('rps') and values['rps']:
+                change = "{0:+.1f}%".format(
+                    (values['rps'] / old['rps'] - 1) * 100)
+            print("{0:<12} {1:<14} {2:>10.1f} {3:>9} {4:>9} {5:>7d} "
+                  "{6:>9.1f} {7:>8}".format(
+                      target['target'], scenario, values['rps'] or 0,
+                      format_ms(values['p50']), format_ms(values['p99']),
+                      values['errors'], values['peak_rss'] / (1 << 20),
+                      change))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        "\n")[0])
+    parser.add_argument(
+        '--targets', default=None,
+        help="comma separated: inprocess and server adapter names, "
+             "default all")
+    parser.add_argument(
+        '--scenarios', default=",".join(ORDER),
+        help="comma separated, default all: {0}".format(", ".join(ORDER)))
+    parser.add_argument('--clients', type=int, default=8,
+                        help="concurrent clients")
+    parser.add_argument('--connections', type=int, default=6,
+                        help="connections of the server adapters")
+    parser.add_argument('--requests', type=int, default=1000,
+                        help="measured requests per scenario")
+    parser.add_argument('--warmup', type=int, default=50,
+                        help="unmeasured requests per scenario")
+    parser.add_argument('--files', type=int, default=10000,
+                        help="files in the stub file tree")
+    parser.add_argument('--download-size', type=int, default=16,
+                        help="size of the downloaded file, in MiB")
+    parser.add_argument('--encoding', default="gzip",
+                        help="Accept-Encoding of the requests")
+    parser.add_argument('--workdir', default=None,
+                        help="where the webui keeps its sessions, "
+                             "default a temporary directory")
+    parser.add_argument('--output', default=None,
+                        help="save the results as json to this file")
+    parser.add_argument('--compare', default=None,
+                        help="json results of a previous run")
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+
+    options = parser.parse_args(argv)
+    options.scenarios = [name for name in options.scenarios.split(",")
+                         if name]
+    unknown = set(options.scenarios).difference(SCENARIOS)
+    if unknown:
+        parser.error("Unknown scenarios: {0}".format(", ".join(unknown)))
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    if options.worker:
+        result = run_target(options)
+        with io.open(options.output, 'w', encoding='utf-8') as fp:
+            fp.write(str(json.dumps(result)))
+        return 0
+
+    try:
+        from pyload.webui.servers import all_server
+    except ImportError as e:
+        print("The webui is not installed with pyLoad: {0}".format(e))
+        return 1
+
+    if options.targets:
+        targets = options.targets.split(",")
+    else:
+        targets = [INPROCESS] + [server.NAME for server in all_server]
+    if options.workdir is None:
+        options.workdir = tempfile.mkdtemp(prefix="pyload-bench-")
+
+    results = {
+        'version': get_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'options': {
+            'clients': options.clients,
+            'connections': options.connections,
+            'requests': options.requests,
+            'warmup': options.warmup,
+            'files': options.files,
+            'download_size': options.download_size,
+            'encoding': options.encoding},
+        'targets': [spawn_target(target, options) for target in targets]}
+
+    baseline = None
+    if options.compare:
+        with io.open(options.compare, encoding='utf-8') as fp:
+            baseline = json.load(fp)
+    report(results, baseline)
+
+    if options.output:
+        with io.open(options.output, 'w', encoding='utf-8') as fp:
+            fp.write(str(json.dumps(results, indent=2, sort_keys=True)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the pyLoad core, serving realistic api results from memory,
+so the webui can be benchmarked without a running core. The pyLoad package
+the webui is installed in is still needed, for the modules of the core it
+imports.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import os
+import tempfile
+import time
+from builtins import int, object, range
+
+from future import standard_library
+
+standard_library.install_aliases()
+
+USERNAME = "bench"
+PASSWORD = "bench"
+
+# every permission bit set
+ALL_PERMISSIONS = 0xff
+
+
+def _hash(password, salt=b"pyload"):
+    # similar cost to the password check done by the core
+    return hashlib.pbkdf2_hmac(
+        'sha256', password.encode('utf-8'), salt, 10000)
+
+
+class StubUser(object):
+
+    __slots__ = ['name', 'permission', 'role', 'uid']
+
+    def __init__(self, uid, name, admin=True):
+        self.uid = uid
+        self.name = name
+        self.role = 0 if admin else 1
+        self.permission = ALL_PERMISSIONS
+
+    def is_admin(self):
+        return self.role == 0
+
+    def has_permission(self, perm):
+        # the core takes permission names as well, the stub user has all
+        if not isinstance(perm, int):
+            return self.permission == ALL_PERMISSIONS
+        return bool(perm & self.permission)
+
+
+class StubExternal(object):
+    """
+    The methods exposed through the api
+    """
+    def get_status_info(self):
+        pass
+
+    def get_file_tree(self, pid, full):
+        pass
+
+    def get_package_info(self, pid):
+        pass
+
+    def get_file_path(self, fid):
+        pass
+
+    def get_config_value(self, section, option):
+        pass
+
+    def get_ws_address(self):
+        pass
+
+
+class StubApi(object):
+
+    EXTERNAL = StubExternal
+
+    def __init__(self, config, nfiles, download):
+        self.config = config
+        self.download = download
+        self.user = StubUser(1, USERNAME)
+        self._password = _hash(PASSWORD)
+        self._tree = self._build_tree(nfiles)
+
+    @staticmethod
+    def _build_tree(nfiles, per_package=100):
+        files = {}
+        packages = {}
+        for fid in range(1, nfiles + 1):
+            pid = (fid - 1) // per_package + 1
+            files[fid] = {
+                'fid': fid,
+                'name': "file.part{0:03d}.rar".format(fid % per_package),
+                'package': pid,
+                'owner': 1,
+                'size': 104857600 + fid,
+                'status': 0,
+                'media': 2,
+                'added': 1500000000 + fid,
+                'fileorder': fid % per_package,
+                'download': {
+                    'url': "http://example.com/files/{0:d}".format(fid),
+                    'plugin': "BasePlugin",
+                    'hash': "",
+                    'status': 3,
+                    'statusmsg': "finished",
+                    'error': ""}}
+            if pid not in packages:
+                packages[pid] = {
+                    'pid': pid,
+                    'name': "Package {0:d}".format(pid),
+                    'folder': "package_{0:d}".format(pid),
+                    'root': -1,
+                    'owner': 1,
+                    'site': "",
+                    'comment': "",
+                    'password': "",
+                    'added': 1500000000 + pid,
+                    'tags': [],
+                    'status': 0,
+                    'shared': False,
+                    'packageorder': pid,
+                    'stats': {
+                        'linkstotal': per_package,
+                        'linksdone': per_package,
+                        'sizetotal': per_package * 104857600,
+                        'sizedone': per_package * 104857600},
+                    'fids': [],
+                    'pids': []}
+            packages[pid]['fids'].append(fid)
+        return {'root': -1, 'files': files, 'packages': packages}
+
+    def with_user_context(self, uid):
+        return StubUserApi(self, self.user) if uid == self.user.uid else None
+
+    def is_authorized(self, func, user):
+        return True
+
+    def check_auth(self, username, password, remoteip=None):
+        if username == USERNAME and _hash(password or "") == self._password:
+            return self.user
+        return None
+
+    def get_status_info(self):
+        return {
+            'speed': 1048576,
+            'linkstotal': len(self._tree['files']),
+            'linksqueue': 42,
+            'sizetotal': 1 << 40,
+            'sizequeue': 1 << 32,
+            'notifications': 0,
+            'paused': False,
+            'download': True,
+            'reconnect': False,
+            'quota': -1}
+
+    def get_file_tree(self, pid, full):
+        return self._tree
+
+    def get_package_info(self, pid):
+        return self._tree['packages'][pid]
+
+    def get_file_path(self, fid):
+        return os.path.split(self.download)
+
+    def get_config_value(self, section, option):
+        return self.config.get(section, option)
+
+    def get_ws_address(self):
+        return "ws://%s:7227"
+
+
+class StubUserApi(object):
+
+    def __init__(self, api, user):
+        self.api = api
+        self.user = user
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+
+class StubConfig(object):
+
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, section, option):
+        return self.values[section][option]
+
+
+class StubCore(object):
+
+    def __init__(self, nfiles=10000, download_size=16 << 20):
+        self.tmpdir = tempfile.mkdtemp(prefix="pyload-bench-")
+        download = os.path.join(self.tmpdir, "download.bin")
+        with open(download, 'wb') as fp:
+            for _ in range(download_size >> 20):
+                fp.write(os.urandom(1 << 20))
+        self.config = StubConfig({
+            'general': {'storage_folder': self.tmpdir},
+            'webui': {
+                'prefix': "",
+                'debug': False,
+                'port': 8001,
+                'external': False,
+                'session_store': 'memory'}})
+        self.api = StubApi(self.config, nfiles, download)
+        self.start_time = time.time()
+
+
+def install(core):
+    """
+    Make `core` the one the webui is served for, must be called before
+    the webui modules are imported
+    """
+    from pyload.core.thread import webserver
+
+    webserver.core = core
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+from builtins import int
+
+from future import standard_library
+
+from bottle import request, response, route, static_file
+
+from .api import admission, authenticate, error, json_response, profiler
+from .iface import WORKER, load, sampler, session_store
+from .metrics import registry
+from .pyload import throttle
+from .utils import add_json_header
+
+standard_library.install_aliases()
+
+registry.gauge('requests_in_progress', lambda: load.active)
+registry.gauge('workers', lambda: load.capacity)
+registry.gauge('sampler_samples', lambda: sampler.samples, kind='counter')
+for _name in ('hits', 'misses', 'evictions', 'expired'):
+    registry.gauge('session_store_' + _name,
+                   lambda name=_name: session_store.stats()[name],
+                   kind='counter')
+registry.gauge('api_calls_running', lambda: admission.active)
+registry.gauge('api_calls_waiting', lambda: admission.waiting)
+registry.gauge('api_calls_admitted_total', lambda: admission.admitted,
+               kind='counter')
+registry.gauge('api_calls_wait_seconds_total', lambda: admission.wait_time,
+               kind='counter')
+for _reason in ('queue', 'timeout'):
+    registry.gauge('api_calls_rejected_total',
+                   lambda reason=_reason: admission.rejected.get(reason, 0),
+                   (('reason', _reason),), kind='counter')
+registry.gauge('download_bandwidth_limit_bytes', lambda: throttle.limit)
+registry.gauge('download_bandwidth_user_limit_bytes',
+               lambda: throttle.user_limit)
+registry.gauge('download_throttled_seconds_total', lambda: throttle.delayed,
+               kind='counter')
+
+
+def admin_required(func):
+    def _view(*args, **kwargs):
+        api = authenticate()
+        if api is None:
+            return error(401, "Unauthorized")
+        if not api.user.is_admin():
+            return error(403, "Forbidden")
+        return func(*args, **kwargs)
+
+    return _view
+
+
+@route("/api/_metrics")
+@admin_required
+def metrics():
+    # each worker would only report its own share
+    if WORKER:
+        return error(501, "Not available with multiple processes")
+    response.content_type = "text/plain; version=0.0.4; charset=utf-8"
+    return registry.render()
+
+
+@route("/api/_profiles")
+@admin_required
+def profiles():
+    add_json_header(response)
+    return json_response(profiler.entries())
+
+
+# dynamic /api routes would be taken by call_api, so the name is a parameter
+@route("/api/_profile")
+@admin_required
+def profile():
+    return static_file(request.query.get('file', ""), root=profiler.path,
+                       download=True, mimetype='application/octet-stream')
+
+
+# folded stacks collected by the sampler, `?reset=1` starts over
+@route("/api/_stacks")
+@admin_required
+def stacks():
+    response.content_type = "text/plain; charset=utf-8"
+    response.headers['Content-Disposition'] = \
+        'attachment; filename="stacks.folded"'
+    return sampler.folded(bool(request.query.get('reset')))
+
+
+# bandwidth limits of the downloads in bytes per second, posting `limit` or
+# `user_limit` changes them until restart, not with multiple processes
+@route("/api/_bandwidth", method=['GET', 'POST'])
+@admin_required
+def bandwidth():
+    if request.method == 'POST' and WORKER:
+        return error(501, "Not available with multiple processes")
+    if request.method == 'POST':
+        values = {}
+        for name in ('limit', 'user_limit'):
+            value = request.params.get(name)
+            if value is None or value == "":
+                continue
+            try:
+                values[name] = int(value)
+                if values[name] < 0:
+                    raise ValueError(value)
+            except ValueError:
+                return error(400, "Invalid Input: {0}".format(name))
+        throttle.configure(**values)
+    add_json_header(response)
+    return json_response({'limit': throttle.limit,
+                          'user_limit': throttle.user_limit})
+
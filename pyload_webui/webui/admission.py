@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+import types
+from builtins import object
+from contextlib import contextmanager
+from threading import Condition, Lock
+
+from future import standard_library
+
+standard_library.install_aliases()
+
+
+class Rejected(Exception):
+    """
+    Raised when a call is not admitted, `reason` tells which limit was hit
+    """
+    def __init__(self, reason, retry_after):
+        Exception.__init__(self, reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionControl(object):
+    """
+    Bound the api calls handled at once, so a burst is shed early instead of
+    queuing up behind the few server workers.
+
+    At most `limit` calls run, up to `queue` more wait at most `timeout`
+    seconds for a slot, the others are rejected right away. Each user and
+    each address may additionally run only `per_user` and `per_ip` calls,
+    the ones over wait like the others, so nobody can take all the slots.
+
+    :param retry_after: seconds rejected clients are asked to wait
+    """
+    def __init__(self, limit, queue=0, timeout=1.0, per_user=0, per_ip=0,
+                 retry_after=1):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.per_user = per_user
+        self.per_ip = per_ip
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = {}
+        self.wait_time = 0.0
+        # calls running, by user and address
+        self._running = {}
+        self._cond = Condition(Lock())
+
+    def _caps(self, user, ip):
+        caps = []
+        if self.per_user and user is not None:
+            caps.append((('user', user), self.per_user))
+        if self.per_ip and ip:
+            caps.append((('ip', ip), self.per_ip))
+        return caps
+
+    def _runnable(self, caps):
+        return self.active < self.limit and all(
+            self._running.get(key, 0) < cap for key, cap in caps)
+
+    def _reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise Rejected(reason, self.retry_after)
+
+    def acquire(self, user=None, ip=None):
+        """
+        Wait for a slot for a call of `user` from address `ip`
+
+        :raises Rejected: if the call can not be handled now
+        :return: the keys to pass to `release`
+        """
+        if not self.limit:
+            return ()
+        caps = self._caps(user, ip)
+        keys = [key for key, cap in caps]
+        with self._cond:
+            if not self._runnable(caps):
+                if self.waiting >= self.queue:
+                    self._reject('queue')
+                self._wait(caps)
+            for key in keys:
+                self._running[key] = self._running.get(key, 0) + 1
+            self.active += 1
+            self.admitted += 1
+        return keys
+
+    def _wait(self, caps):
+        start = time.time()
+        deadline = start + self.timeout
+        self.waiting += 1
+        try:
+            while not self._runnable(caps):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._reject('timeout')
+                self._cond.wait(remaining)
+        finally:
+            self.waiting -= 1
+            self.wait_time += time.time() - start
+
+    @staticmethod
+    def _decrement(counts, key):
+        if counts[key] > 1:
+            counts[key] -= 1
+        else:
+            del counts[key]
+
+    def release(self, keys):
+        if not self.limit:
+            return
+        with self._cond:
+            self.active -= 1
+            for key in keys:
+                self._decrement(self._running, key)
+            # waiters may be blocked by different caps, let all of them check
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, user=None, ip=None):
+        keys = self.acquire(user, ip)
+        try:
+            yield
+        finally:
+            self.release(keys)
+
+    def hold(self, body, keys):
+        """
+        Keep the slot taken with `keys` until `body` is sent, streamed
+        bodies are only serialized while sent
+
+        :return: the body to respond with
+        """
+        if not isinstance(body, types.GeneratorType):
+            self.release(keys)
+            return body
+        return HeldBody(body, lambda: self.release(keys))
+
+
+class HeldBody(object):
+    """
+    Response body calling `release` once it is sent, failed or closed;
+    bottle doesn't close bodies failing or empty on the first chunk
+    """
+    __slots__ = ['body', 'release']
+
+    def __init__(self, body, release):
+        self.body = body
+        self.release = release
+
+    def _release(self):
+        release, self.release = self.release, None
+        if release is not None:
+            release()
+
+    def __iter__(self):
+        try:
+            for data in self.body:
+                yield data
+        finally:
+            self._release()
+
+    def close(self):
+        try:
+            self.body.close()
+        finally:
+            self._release()
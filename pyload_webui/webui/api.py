@@ -2,9 +2,14 @@
 
 from __future__ import absolute_import, unicode_literals
 
-import io
+import hashlib
+import hmac
+import logging
+import os
+import time
 from builtins import dict, str
-from contextlib import closing
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 from traceback import format_exc, print_exc
 from urllib.parse import unquote
 
@@ -15,118 +20,464 @@ from pyload.core.datatype import ExceptionObject
 from pyload.rpc.jsonconverter import BaseEncoder, dumps, loads
 from pyload.utils import purge
 
-from .iface import API, session
-from .utils import add_json_header, get_user_api, set_session
+from . import compression
+from .admission import AdmissionControl, Rejected
+from .cache import LRUCache, notify, subscribe
+from .dispatch import InvalidInput, build_table, snake_case
+from .iface import (API, API_IP_LIMIT, API_LIMIT, API_QUEUE,
+                    API_QUEUE_TIMEOUT, API_TOKENS, API_USER_LIMIT,
+                    PROFILE_DIR, PROFILE_KEEP, PROFILE_RATE, TOKEN_SECRET,
+                    TOKEN_TTL, UPLOAD_MAX_SIZE, WORKER, session)
+from .metrics import instrument, registry
+from .profiling import ProfileRing
+from .tokens import TokenManager, is_token
+from .utils import (USER_CHANGES, add_json_header, get_user_api,
+                    is_authorized, limit_request_body, set_session)
 
 standard_library.install_aliases()
 
-# used for gzip compression
-try:
-    import gzip
-except ImportError:
-    gzip = None
-
-
-def json_response(obj):
-    accept = 'gzip' in request.headers.get('Accept-Encoding', '')
-    result = dumps(obj)
+log = logging.getLogger()
+
+# api methods with these prefixes don't change any state, names are
+# compared in snake case, clients use camel case as well
+READONLY_PREFIXES = ('get_', 'is_', 'find_', 'search_')
+
+# max number of calls accepted in a single batch request
+BATCH_MAX_CALLS = 100
+# threads used to execute read-only batch calls concurrently
+BATCH_WORKERS = 4
+
+# results of these methods can grow huge, so they are streamed
+STREAMED = frozenset(['get_file_tree', 'get_package_content', 'find_files'])
+# amount of serialized data collected before a chunk is sent
+CHUNK_SIZE = 64 << 10
+
+_batch_pool = None
+_batch_lock = Lock()
+
+# successful http auth checks, so scripts polling the api don't have to
+# hash the password each time; keys are salted per process; prefork workers
+# keep none, they wouldn't see the changes made through the others
+_credentials = LRUCache(0 if WORKER else 256, 60)
+_credentials_salt = os.urandom(16)
+subscribe(USER_CHANGES, _credentials.clear)
+
+tokens = TokenManager(TOKEN_SECRET, TOKEN_TTL)
+
+# exposed api methods, with the decoders for their arguments
+DISPATCH = build_table(API) if API is not None else {}
+
+# admins can ask for a profile of their call sending this header
+PROFILE_HEADER = 'X-Profile'
+profiler = ProfileRing(PROFILE_DIR, PROFILE_KEEP, PROFILE_RATE)
+
+admission = AdmissionControl(API_LIMIT, API_QUEUE, API_QUEUE_TIMEOUT,
+                             API_USER_LIMIT, API_IP_LIMIT)
+
+
+def make_etag(chunks, encoding=None):
+    """
+    Entity tag of the serialized response, depending on its encoding; weak
+    if compressed, as the compression level follows the load, so the same
+    result is not always sent as the same bytes
+    """
+    h = hashlib.sha1()
+    for chunk in chunks:
+        h.update(chunk)
+    if encoding is None:
+        return '"{0}"'.format(h.hexdigest())
+    return 'W/"{0}-{1}"'.format(h.hexdigest(), encoding)
+
+
+def _opaque(tag):
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_fresh(etag):
+    """
+    Set the `ETag` header and check if the client has the same entity cached
+    """
+    response.headers['ETag'] = etag
+    header = request.get_header('If-None-Match')
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison, as required for If-None-Match
+    tags = [tag.strip() for tag in header.split(",")]
+    return _opaque(etag) in [_opaque(tag) for tag in tags]
+
+
+def not_modified():
+    # bottle drops the body and the content headers by itself
+    response.status = 304
+    return b""
+
+
+def json_response(obj, etag=False):
+    """
+    :param etag: validate the response against the `If-None-Match` header
+    """
+    start = time.time()
+    result = dumps(obj).encode('utf-8')
+    registry.observe('serialize_duration_seconds', time.time() - start)
+    response.headers['Vary'] = 'Accept-Encoding'
     # do not compress small string
-    if not accept or len(result) <= 500:
+    encoding = compression.select_encoding(
+        request.get_header('Accept-Encoding'), size=len(result))
+    if etag and is_fresh(make_etag([result], encoding)):
+        return not_modified()
+    if encoding is None:
         return result
+    response.headers['Content-Encoding'] = encoding
+    start = time.time()
+    result = compression.compress(result, encoding)
+    registry.observe('compress_duration_seconds', time.time() - start,
+                     (('encoding', encoding),))
+    return result
+
+
+def iter_json(obj, encoding=None):
+    """
+    Serialize `obj` incrementally
+
+    :param encoding: compress the output on the fly
+    :return: generator of encoded chunks, at most around `CHUNK_SIZE` long
+    """
+    zobj = None
+    if encoding is not None:
+        zobj = compression.Compressor(encoding)
+
+    buf = []
+    size = 0
+    for fragment in BaseEncoder().iterencode(obj):
+        buf.append(fragment)
+        size += len(fragment)
+        if size < CHUNK_SIZE:
+            continue
+        data = "".join(buf).encode('utf-8')
+        del buf[:]
+        size = 0
+        if zobj is not None:
+            data = zobj.compress(data)
+        # the compressor may still be buffering
+        if data:
+            yield data
+
+    data = "".join(buf).encode('utf-8')
+    if zobj is not None:
+        data = zobj.compress(data) + zobj.flush()
+    if data:
+        yield data
+
+
+def json_stream(obj):
+    """
+    Like `json_response`, but the result is sent in chunks while serializing,
+    so memory usage doesn't depend on the size of `obj`; no entity tag is
+    sent, hashing the result would mean serializing it before the first
+    chunk
+    """
+    # no content-length is known, the server falls back to chunked encoding
     response.headers['Vary'] = 'Accept-Encoding'
-    response.headers['Content-Encoding'] = 'gzip'
-    zbuf = io.StringIO()
-    try:
-        with closing(gzip.GzipFile(mode='wb', compresslevel=6, fileobj=zbuf)) as fp:
-            fp.write(result)
-    except AttributeError:
-        pass
-    return zbuf.getvalue()
+    encoding = compression.select_encoding(
+        request.get_header('Accept-Encoding'))
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return iter_json(obj, encoding)
 
 
 # returns http error
 def error(code, msg):
     return HTTPError(code, dumps(msg), **dict(response.headers))
 
-# accepting positional arguments, as well as kwargs via post and get
-# only forbidden path symbol are "?", which is used to separate GET data and #
-
-
-@route("/api/<func><args:re:[^#?]*>")
-@route("/api/<func><args:re:[^#?]*>", method="POST")
-def call_api(func, args=""):
-    add_json_header(response)
 
+def overloaded(rejected):
+    """
+    Tell the client to come back later, instead of waiting for the core
+    """
+    response.headers['Retry-After'] = str(rejected.retry_after)
+    return error(503, "Service Unavailable")
+
+
+def check_auth(username, password, remote_addr):
+    """
+    Like `API.check_auth`, but successful checks are cached for a while
+    """
+    key = hmac.new(_credentials_salt, "\0".join(
+        (username, password, remote_addr or "")).encode('utf-8'),
+        hashlib.sha256).digest()
+    user = _credentials.get(key)
+    if user is None:
+        user = API.check_auth(username, password, remote_addr)
+        if user:
+            _credentials.set(key, user)
+    return user
+
+
+def get_token():
+    """
+    Signed token sent as `session` parameter or as bearer authorization
+    """
+    if not API_TOKENS:
+        return None
+    header = request.get_header('Authorization', '')
+    if header.startswith("Bearer "):
+        return header[7:].strip()
+    sid = request.params.get('session')
+    if sid:
+        sid = purge.chars(sid, "'\"")
+        if is_token(sid):
+            return sid
+    return None
+
+
+def authenticate():
+    """
+    Resolve the user api context of the current request
+
+    :return: the user api or None if the request is not authenticated
+    """
     s = request.environ.get('beaker.session')
     # Accepts standard http auth
     auth = parse_auth(request.get_header('Authorization', ''))
-    if 'session' in request.POST or 'session' in request.GET:
+    token = get_token()
+    if token:
+        # validated without any session lookup
+        uid = tokens.validate(token)
+        s = {'uid': uid} if uid is not None else None
+    elif 'session' in request.POST or 'session' in request.GET:
         # removes "' so it works on json strings
         s = s.get_by_id(purge.chars(request.params.get('session'), "'\""))
     elif auth:
-        user = API.check_auth(
+        user = check_auth(
             auth[0], auth[1], request.environ.get('REMOTE_ADDR', None))
         # if auth is correct create a pseudo session
         if user:
             s = {'uid': user.uid}
 
-    api = get_user_api(s)
+    return get_user_api(s)
+
+
+def check_call(api, func):
+    """
+    Check if `func` can be called through the given user api
+
+    :return: tuple of error code and message on failure, None otherwise
+    """
+    method = DISPATCH.get(func)
+    allowed = None if method is None else method.allowed(api.user)
+    if allowed is None:
+        allowed = is_authorized(api, func)
+    if not allowed:
+        return 403, "Forbidden"
+
+    if method is None:
+        log.debug("Invalid API call: {0}".format(func))
+        return 404, "Not Found"
+
+    return None
+
+
+def is_read_only(func):
+    return snake_case(func).startswith(READONLY_PREFIXES)
+
+
+def invoke(api, func, args, kwgs):
+    result = DISPATCH[func].call(api, args, kwgs)
+    # drop cached data invalidated by the call
+    notify(snake_case(func))
+    # null is invalid json response
+    if result is None:
+        result = True
+    return result
+
+
+def respond(api, func, args, kwgs):
+    result = invoke(api, func, args, kwgs)
+    if snake_case(func) in STREAMED:
+        return json_stream(result)
+    # unchanged results of read-only calls are not sent again
+    return json_response(result, is_read_only(func))
+
+
+def api_label(kwargs):
+    # unknown names are not recorded, they could be anything
+    func = kwargs.get('func')
+    return func if func in DISPATCH else ""
+
+
+# accepting positional arguments, as well as kwargs via post and get
+# only forbidden path symbol are "?", which is used to separate GET data and #
+
+
+@route("/api/<func><args:re:[^#?]*>")
+@route("/api/<func><args:re:[^#?]*>", method="POST")
+@instrument(api_label)
+def call_api(func, args=""):
+    add_json_header(response)
+    # must be set up before anything reads the body
+    limit_request_body(UPLOAD_MAX_SIZE)
+
+    api = authenticate()
     if not api:
         return error(401, "Unauthorized")
 
-    if not API.is_authorized(func, api.user):
-        return error(403, "Forbidden")
-
-    if not hasattr(API.EXTERNAL, func) or func.startswith("_"):
-        print("Invalid API call", func)
-        return error(404, "Not Found")
+    err = check_call(api, func)
+    if err is not None:
+        return error(*err)
 
     # TODO: possible encoding
-    # TODO: Better error codes on invalid input
 
-    args = [loads(unquote(arg)) for arg in args.split("/")[1:]]
+    method = DISPATCH[func]
     kwgs = {}
 
     # accepts body as json dict
     if request.json:
         kwgs = request.json
+        if not isinstance(kwgs, dict):
+            return error(400, "Invalid arguments")
 
-    # file upload, reads whole file into memory
+    # file upload, big files are already spooled to disk while parsing,
+    # so the api gets a file object instead of the whole content
     for name, file in request.files.items():
         kwgs['filename'] = file.filename
-        with closing(io.StringIO()) as content:
-            file.save(content)
-            kwgs[name] = content.getvalue()
+        file.file.seek(0)
+        kwgs[name] = file.file
 
-    # convert arguments from json to obj separately
+    params = {}
     for x, y in request.params.items():
-        try:
-            if not x or not y or x == "session":
-                continue
-            kwgs[x] = loads(unquote(y))
-        except Exception as e:
-            # Unsupported input
-            msg = "Invalid Input {0}, {1} : {2}".format(x, y, str(e))
-            print_exc()
-            print(msg)
-            return error(415, msg)
+        if not x or not y or x == "session":
+            continue
+        params[x] = unquote(y)
 
+    # convert arguments as expected by the method signature
     try:
-        result = getattr(api, func)(*args, **kwgs)
-        # null is invalid json response
-        if result is None:
-            result = True
-        return json_response(result)
+        args, params = method.decode(
+            [unquote(arg) for arg in args.split("/")[1:]], params)
+        kwgs.update(params)
+        method.check(args, kwgs)
+    except InvalidInput as e:
+        return error(400, str(e))
 
+    requested = bool(request.get_header(PROFILE_HEADER)) and \
+        api.user.is_admin()
+    try:
+        keys = admission.acquire(
+            api.user.uid, request.environ.get('REMOTE_ADDR'))
+    except Rejected as e:
+        return overloaded(e)
+    try:
+        if profiler.wanted(requested):
+            result = profiler.capture(func, respond, api, func, args, kwgs)
+        else:
+            result = respond(api, func, args, kwgs)
     except ExceptionObject as e:
+        admission.release(keys)
         return error(400, str(e))
     except Exception as e:
+        admission.release(keys)
         print_exc()
         return error(500, {'error': str(e), 'traceback': format_exc()})
+    # streamed results are serialized and compressed while sent, which
+    # must happen within the slot as well
+    return admission.hold(result, keys)
+
+
+def batch_call(api, call):
+    """
+    Execute a single call of a batch request
+
+    :return: dict holding either the `result` or the `error` and its `code`
+    """
+    if not isinstance(call, dict) or not call.get('func'):
+        return {'error': "Invalid call", 'code': 400}
+
+    func = call['func']
+    args = call.get('args') or []
+    kwgs = call.get('kwargs') or {}
+    if not isinstance(args, list) or not isinstance(kwgs, dict):
+        return {'error': "Invalid arguments", 'code': 400}
+
+    err = check_call(api, func)
+    if err is not None:
+        return {'error': err[1], 'code': err[0]}
+
+    try:
+        DISPATCH[func].check(args, kwgs)
+    except InvalidInput as e:
+        return {'error': str(e), 'code': 400}
+
+    try:
+        return {'result': invoke(api, func, args, kwgs)}
+
+    except ExceptionObject as e:
+        return {'error': str(e), 'code': 400}
+    except Exception as e:
+        print_exc()
+        return {'error': str(e), 'code': 500}
+
+
+def get_batch_pool():
+    global _batch_pool
+    with _batch_lock:
+        if _batch_pool is None:
+            _batch_pool = ThreadPool(BATCH_WORKERS)
+    return _batch_pool
+
+
+# accepts a json list of calls `{"func": ..., "args": [], "kwargs": {}}`,
+# or a dict `{"calls": [...], "parallel": true}` to run read-only calls
+# concurrently; results are returned in the same order
+
+
+@route("/api/batch", method="POST")
+@instrument()
+def batch():
+    add_json_header(response)
+    limit_request_body(UPLOAD_MAX_SIZE)
+
+    api = authenticate()
+    if not api:
+        return error(401, "Unauthorized")
+
+    try:
+        data = loads(request.body.read().decode('utf-8'))
+    except Exception as e:
+        return error(415, "Invalid Input: {0}".format(str(e)))
+
+    parallel = False
+    if isinstance(data, dict):
+        parallel = bool(data.get('parallel'))
+        data = data.get('calls')
+
+    if not isinstance(data, list):
+        return error(400, "Invalid batch")
+
+    if len(data) > BATCH_MAX_CALLS:
+        return error(413, "Too many calls")
+
+    # the whole batch takes a single slot
+    try:
+        with admission.admit(
+                api.user.uid, request.environ.get('REMOTE_ADDR')):
+            # calls are executed concurrently only if none of them changes
+            # anything, otherwise the order of execution must be preserved
+            if parallel and len(data) > 1 and all(
+                    isinstance(call, dict) and
+                    is_read_only(call.get('func') or "") for call in data):
+                results = get_batch_pool().map(
+                    lambda call: batch_call(api, call), data)
+            else:
+                results = [batch_call(api, call) for call in data]
+            return json_response(results)
+    except Rejected as e:
+        return overloaded(e)
 
 
 @route("/api/login")
 @route("/api/login", method="POST")
+@instrument()
 def login():
     add_json_header(response)
 
@@ -141,12 +492,15 @@ def login():
 
     s = set_session(request, user)
 
-    # get the session id by dirty way, documentations seems wrong
-    try:
-        sid = s._headers['cookie_out'].split("=")[1].split(";")[0]
-    # reuse old session id
-    except Exception:
-        sid = request.get_header(session.options['key'])
+    if API_TOKENS:
+        sid = tokens.issue(user.uid)
+    else:
+        # get the session id by dirty way, documentations seems wrong
+        try:
+            sid = s._headers['cookie_out'].split("=")[1].split(";")[0]
+        # reuse old session id
+        except Exception:
+            sid = request.get_header(session.options['key'])
 
     result = BaseEncoder().default(user)
     result['session'] = sid
@@ -160,9 +514,14 @@ def login():
 
 @route("/api/logout")
 @route("/api/logout", method="POST")
+@instrument()
 def logout():
     add_json_header(response)
 
+    token = get_token()
+    if token:
+        tokens.revoke(token)
+
     s = request.environ.get('beaker.session')
     s.delete()
 
@@ -56,7 +56,8 @@ define([
     options.dataType = 'json';
 
     if (data) {
-      options.type = 'POST';
+      // read-only calls are sent as GET, so the browser revalidates them
+      options.type = /^(get|is|find|search)[A-Z_]/.test(method) ? 'GET' : 'POST';
       options.data = {};
       // Convert arguments to json
       _.keys(data).map(function(key) {
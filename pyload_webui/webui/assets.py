@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import time
+from builtins import dict, int, object, str
+from threading import Lock
+
+from future import standard_library
+
+from bottle import HTTPError, HTTPResponse, parse_date, request, static_file
+
+from . import compression
+
+standard_library.install_aliases()
+
+log = logging.getLogger()
+
+# written by the `build_assets` command of the setup script
+MANIFEST = 'manifest.json'
+
+# fingerprinted files never change, clients may keep them for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# extensions of the precompressed files, by encoding
+_EXTENSIONS = dict(compression.EXTENSIONS)
+
+
+class Variant(object):
+    """
+    A file as sent, `data` is only set if kept in memory
+    """
+    __slots__ = ['data', 'etag', 'length', 'mtime', 'path']
+
+    def __init__(self, path, etag, length, mtime, data=None):
+        self.path = path
+        self.etag = etag
+        self.length = length
+        self.mtime = mtime
+        self.data = data
+
+    def read(self):
+        if self.data is not None:
+            return self.data
+        with open(self.path, 'rb') as fp:
+            return fp.read()
+
+
+class Asset(object):
+    """
+    A file of the webui, with its precompressed variants by encoding;
+    `immutable` if its name contains a hash of its content
+    """
+    __slots__ = ['immutable', 'mimetype', 'original', 'variants']
+
+    def __init__(self, mimetype, original, variants, immutable=False):
+        self.mimetype = mimetype
+        self.original = original
+        self.variants = variants
+        self.immutable = immutable
+
+    def read(self):
+        return self.original.read()
+
+
+def _mimetype(filename):
+    mimetype, encoding = mimetypes.guess_type(filename)
+    if mimetype is None:
+        return 'application/octet-stream'
+    if mimetype.startswith('text/') or mimetype == 'application/javascript':
+        mimetype += '; charset=UTF-8'
+    return mimetype
+
+
+def fresh(etag, mtime=None):
+    """
+    Check the conditional headers of the request
+
+    :return: True if the client has the version with `etag` and `mtime`
+    """
+    match = request.environ.get('HTTP_IF_NONE_MATCH')
+    if match is not None:
+        return match.strip() == "*" or etag in [
+            tag.strip().lstrip("W/") for tag in match.split(",")]
+    since = request.environ.get('HTTP_IF_MODIFIED_SINCE')
+    if since and mtime is not None:
+        since = parse_date(since.split(";")[0].strip())
+        return since is not None and since >= int(mtime)
+    return False
+
+
+class AssetCache(object):
+    """
+    Index of the files under `root`, built once so requests don't touch the
+    disk: files up to `max_size` bytes are kept in memory, up to `max_total`
+    bytes in all, with strong entity tags computed from their content.
+
+    A built webui comes with a manifest listing its files, their hashes and
+    precompressed variants, so they don't have to be searched and hashed.
+
+    :param refresh: check the files for changes on each request, for
+        development
+    :param offload: `transfer.Offload` handing the files to the reverse
+        proxy, which then picks the variants and answers conditional
+        requests itself
+    """
+    def __init__(self, root, max_size=256 << 10, max_total=32 << 20,
+                 refresh=False, offload=None):
+        self.root = root
+        self.max_size = max_size
+        self.max_total = max_total
+        self.refresh = refresh
+        self.offload = offload
+        self.size = 0
+        self.assets = {}
+        self._lock = Lock()
+        self.scan()
+
+    def scan(self):
+        self.size = 0
+        path = os.path.join(self.root, MANIFEST)
+        if not self.refresh and os.path.isfile(path):
+            try:
+                self.assets = self._read_manifest(path)
+                return
+            except (IOError, KeyError, TypeError, ValueError) as e:
+                log.warning("Invalid webui manifest: {0}".format(str(e)))
+                self.size = 0
+        assets = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            names = set(filenames)
+            for name in filenames:
+                if name == MANIFEST and dirpath == self.root:
+                    continue
+                # precompressed variants belong to the original
+                base, ext = os.path.splitext(name)
+                if ext in _EXTENSIONS.values() and base in names:
+                    continue
+                path = os.path.join(dirpath, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                asset = self._load(key)
+                if asset is not None:
+                    assets[key] = asset
+        self.assets = assets
+
+    def _read_manifest(self, path):
+        with open(path, 'rb') as fp:
+            manifest = json.loads(fp.read().decode('utf-8'))
+        mtime = manifest['mtime']
+        assets = {}
+        for key, info in manifest['assets'].items():
+            path = self._path(key)
+            if path is None:
+                continue
+            original = self._entry(path, info['sha1'], info['size'], mtime)
+            variants = {}
+            for encoding, variant in info['encodings'].items():
+                variants[encoding] = self._entry(
+                    path + variant['ext'],
+                    "{0}-{1}".format(info['sha1'], encoding),
+                    variant['size'], mtime)
+            assets[key] = Asset(_mimetype(key), original, variants,
+                                info['immutable'])
+        return assets
+
+    def _entry(self, path, etag, length, mtime):
+        data = None
+        if length <= self.max_size and self.size + length <= self.max_total:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            self.size += len(data)
+        return Variant(path, '"{0}"'.format(etag), length, mtime, data)
+
+    def _variant(self, path, encoding=None):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        data = None
+        if stat.st_size <= self.max_size and \
+                self.size + stat.st_size <= self.max_total:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            self.size += len(data)
+            etag = hashlib.sha1(data).hexdigest()
+        else:
+            # not read just to be hashed
+            etag = "{0:x}-{1:x}".format(stat.st_size, int(stat.st_mtime))
+        if encoding is not None:
+            etag = "{0}-{1}".format(etag, encoding)
+        return Variant(path, '"{0}"'.format(etag), stat.st_size,
+                       stat.st_mtime, data)
+
+    def _path(self, key):
+        """
+        :return: the path of the file named `key`, None if it is not one
+            under the root
+        """
+        parts = key.split("/")
+        if any(part in ("", ".", "..") for part in parts):
+            return None
+        root = os.path.join(os.path.abspath(self.root), "")
+        path = os.path.abspath(os.path.join(root, *parts))
+        if not path.startswith(root):
+            return None
+        return path
+
+    def _load(self, key):
+        path = self._path(key)
+        if path is None or not os.path.isfile(path):
+            return None
+        original = self._variant(path)
+        if original is None:
+            return None
+        variants = {}
+        for encoding, ext in compression.EXTENSIONS:
+            variant = self._variant(path + ext, encoding)
+            if variant is not None:
+                variants[encoding] = variant
+        return Asset(_mimetype(key), original, variants)
+
+    def _changed(self, asset):
+        try:
+            stat = os.stat(asset.original.path)
+        except OSError:
+            return True
+        return stat.st_mtime != asset.original.mtime or \
+            stat.st_size != asset.original.length
+
+    def get(self, filename):
+        """
+        :return: the `Asset` named `filename`, None if there is none
+        """
+        asset = self.assets.get(filename)
+        if self.refresh and (asset is None or self._changed(asset)):
+            with self._lock:
+                for variant in (asset.variants.values() if asset else ()):
+                    self.size -= len(variant.data or b"")
+                if asset is not None:
+                    self.size -= len(asset.original.data or b"")
+                asset = self._load(filename)
+                if asset is None:
+                    self.assets.pop(filename, None)
+                else:
+                    self.assets[filename] = asset
+        return asset
+
+    def serve(self, filename, encodings=True):
+        """
+        Respond with the asset `filename`, precompressed if the client
+        accepts it
+
+        :param encodings: False to always send the original
+        """
+        asset = self.get(filename)
+        if asset is None:
+            return HTTPError(404, "File does not exist.")
+
+        if self.offload is not None:
+            headers = {'Cache-Control': IMMUTABLE} if asset.immutable else {}
+            resp = self.offload.response(
+                asset.original.path, asset.mimetype, headers=headers)
+            if resp is not None:
+                return resp
+
+        variant = asset.original
+        encoding = None
+        if encodings and asset.variants:
+            encoding = compression.select_encoding(
+                request.get_header("Accept-Encoding"),
+                [name for name, ext in compression.EXTENSIONS
+                 if name in asset.variants])
+            if encoding is not None:
+                variant = asset.variants[encoding]
+
+        headers = {
+            'ETag': variant.etag,
+            'Last-Modified': time.strftime(
+                "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(variant.mtime))}
+        if encodings and asset.variants:
+            headers['Vary'] = "Accept-Encoding"
+        if asset.immutable:
+            headers['Cache-Control'] = IMMUTABLE
+
+        if fresh(variant.etag, variant.mtime):
+            return HTTPResponse(status=304, **headers)
+
+        headers['Content-Type'] = asset.mimetype
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+
+        if variant.data is not None:
+            headers['Content-Length'] = str(variant.length)
+            body = b"" if request.method == 'HEAD' else variant.data
+            return HTTPResponse(body, **headers)
+
+        if request.environ.get('HTTP_RANGE') and encoding is None:
+            # partial content of the original
+            return static_file(filename, root=self.root,
+                               mimetype=asset.mimetype.split(";")[0])
+        headers['Content-Length'] = str(variant.length)
+        if request.method == 'HEAD':
+            return HTTPResponse(b"", **headers)
+        # sent by `wsgi.file_wrapper` if the server has one
+        return HTTPResponse(open(variant.path, 'rb'), **headers)
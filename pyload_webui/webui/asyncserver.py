@@ -0,0 +1,707 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP/1.1 server on asyncio: connections, keep-alive and slow clients are
+handled by the event loop, only the wsgi application runs in a thread pool.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import os
+import sys
+import threading
+import traceback
+from builtins import int, object, str
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from email.utils import formatdate
+from urllib.parse import unquote
+from wsgiref.util import FileWrapper
+
+from future import standard_library
+
+standard_library.install_aliases()
+
+# seconds an idle keep-alive connection is kept open
+KEEPALIVE_TIMEOUT = 75
+# seconds a client has to send the headers, and the buffered part of the
+# body, of a request
+REQUEST_TIMEOUT = 30
+# longest request line and headers accepted
+MAX_HEADER_SIZE = 64 << 10
+# request bodies up to this size are received before the application is
+# called, larger ones are streamed to it; reading from the client pauses
+# while that much is waiting to be read by the application
+BODY_BUFFER_SIZE = 256 << 10
+# seconds the application waits for the client to send more of the body, or
+# to take more of the response, before the connection is dropped
+IO_TIMEOUT = 60
+# files are sent in pieces of this size, each taken within the timeout
+SENDFILE_CHUNK_SIZE = 256 << 10
+# chunked request bodies are received whole before the application is
+# called, as it needs their length, up to this size
+MAX_CHUNKED_SIZE = 16 << 20
+# longest chunk size or trailer line accepted
+MAX_CHUNK_LINE = 4 << 10
+
+_REASONS = {
+    400: "Bad Request",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+    505: "HTTP Version Not Supported",
+}
+
+
+class BodyReader(object):
+    """
+    The `wsgi.input` of a request, filled by the event loop and read by the
+    application thread.
+    """
+    def __init__(self, protocol, length):
+        self.protocol = protocol
+        # bytes not received yet
+        self.remaining = length
+        self.buffer = bytearray()
+        self.aborted = False
+        # the application waits for more than what is buffered
+        self.waiting = False
+        self._cond = threading.Condition()
+
+    @property
+    def complete(self):
+        return not self.remaining
+
+    def feed(self, data):
+        with self._cond:
+            self.buffer.extend(data)
+            self.remaining -= len(data)
+            self._cond.notify_all()
+
+    def abort(self):
+        with self._cond:
+            self.aborted = True
+            self._cond.notify_all()
+
+    def _wait(self, ready):
+        if not ready() and self.remaining and not self.aborted:
+            self.waiting = True
+            if self.protocol.paused:
+                self.protocol.call(self.protocol.resume)
+            try:
+                while not ready() and self.remaining and not self.aborted:
+                    if not self._cond.wait(IO_TIMEOUT):
+                        # the client stopped sending
+                        self.protocol.call(self.protocol.transport.abort)
+                        raise IOError("Timed out reading the request body")
+            finally:
+                self.waiting = False
+        if self.aborted:
+            raise IOError("Connection lost")
+
+    def _take(self, size):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        if self.protocol.paused:
+            # let the client send more
+            self.protocol.call(self.protocol.resume)
+        return data
+
+    def read(self, size=-1):
+        with self._cond:
+            if size is None or size < 0:
+                self._wait(lambda: False)
+                size = len(self.buffer)
+            else:
+                self._wait(lambda: len(self.buffer) >= size)
+            return self._take(size)
+
+    def readline(self, size=-1):
+        with self._cond:
+            def ready():
+                return b"\n" in self.buffer or \
+                    0 <= size <= len(self.buffer)
+
+            self._wait(ready)
+            end = self.buffer.find(b"\n") + 1 or len(self.buffer)
+            if size is not None and 0 <= size < end:
+                end = size
+            return self._take(end)
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, b""))
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+
+class ChunkedDecoder(object):
+    """
+    Decoder of a chunked request body, fed by the event loop as it arrives;
+    `body` is the data decoded so far, `finished` is set after the last
+    chunk and the trailers.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.body = bytearray()
+        self.state = 'size'
+        self.size = 0
+        self.finished = False
+
+    def _line(self):
+        end = self.buffer.find(b"\r\n")
+        if end < 0:
+            if len(self.buffer) > MAX_CHUNK_LINE:
+                raise ValueError("Chunk line too long")
+            return None
+        line = bytes(self.buffer[:end])
+        del self.buffer[:end + 2]
+        return line
+
+    def feed(self, data):
+        """
+        :raises ValueError: if the body is malformed
+        :return: the bytes following the body, once finished
+        """
+        self.buffer.extend(data)
+        while not self.finished:
+            if self.state == 'size':
+                line = self._line()
+                if line is None:
+                    break
+                size = line.split(b";", 1)[0].strip()
+                if not size or size.strip(b"0123456789abcdefABCDEF"):
+                    raise ValueError("Invalid chunk size")
+                self.size = int(size, 16)
+                self.state = 'data' if self.size else 'trailer'
+            elif self.state == 'data':
+                if not self.buffer:
+                    break
+                data = self.buffer[:self.size]
+                del self.buffer[:len(data)]
+                self.body.extend(data)
+                self.size -= len(data)
+                if not self.size:
+                    self.state = 'end'
+            elif self.state == 'end':
+                if len(self.buffer) < 2:
+                    break
+                if self.buffer[:2] != b"\r\n":
+                    raise ValueError("Missing chunk end")
+                del self.buffer[:2]
+                self.state = 'size'
+            else:
+                line = self._line()
+                if line is None:
+                    break
+                # trailers are ignored, an empty line ends them
+                if not line:
+                    self.finished = True
+        if not self.finished:
+            return b""
+        rest = bytes(self.buffer)
+        del self.buffer[:]
+        return rest
+
+
+class Response(object):
+    """
+    Status, headers and body of a response, written from the application
+    thread.
+    """
+    def __init__(self, protocol, version, head, keep_alive):
+        self.protocol = protocol
+        self.version = version
+        self.head = head
+        self.keep_alive = keep_alive
+        self.status = None
+        self.headers = None
+        self.sent = False
+        self.chunked = False
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info:
+            try:
+                if self.sent:
+                    raise exc_info[1].with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError("Headers already set")
+        self.status = status
+        self.headers = headers
+        return self.write
+
+    def _head(self):
+        code = int(self.status.split(" ", 1)[0])
+        names = set(name.lower() for name, value in self.headers)
+        headers = list(self.headers)
+        bodyless = code < 200 or code in (204, 304)
+        if 'content-length' not in names and not bodyless and \
+                not self.head:
+            if self.version == "HTTP/1.1":
+                self.chunked = True
+                headers.append(("Transfer-Encoding", "chunked"))
+            else:
+                # the end of the body is told by closing the connection
+                self.keep_alive = False
+        for name, value in self.headers:
+            if name.lower() == 'connection' and value.lower() == 'close':
+                self.keep_alive = False
+        if 'connection' not in names:
+            if not self.keep_alive:
+                headers.append(("Connection", "close"))
+            elif self.version == "HTTP/1.0":
+                headers.append(("Connection", "keep-alive"))
+        if 'date' not in names:
+            headers.append(("Date", formatdate(usegmt=True)))
+        lines = ["{0} {1}".format(self.version, self.status)]
+        lines.extend("{0}: {1}".format(name, value)
+                     for name, value in headers)
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    def write(self, data):
+        if self.status is None:
+            raise AssertionError("write() before start_response()")
+        out = b""
+        if not self.sent:
+            out = self._head()
+            self.sent = True
+        if data and not self.head:
+            if self.chunked:
+                out += "{0:x}\r\n".format(len(data)).encode('ascii') + \
+                    data + b"\r\n"
+            else:
+                out += data
+        if out:
+            self.protocol.send(out)
+
+    def sendfile(self, filelike):
+        """
+        Send the body of a `wsgi.file_wrapper` straight from the file, from
+        where it is to the content length
+
+        :return: False if it must be iterated instead
+        """
+        if self.head or self.protocol.server.context is not None or \
+                not hasattr(os, 'sendfile') or \
+                not hasattr(self.protocol.loop, 'sendfile'):
+            return False
+        lengths = [value for name, value in self.headers or ()
+                   if name.lower() == 'content-length']
+        try:
+            filelike.fileno()
+            offset = filelike.tell()
+            count = int(lengths[0])
+        except (AttributeError, IndexError, IOError, ValueError):
+            return False
+        if not self.sent:
+            self.write(b"")
+        if count:
+            try:
+                self.protocol.sendfile(filelike, offset, count)
+            except asyncio.SendfileNotAvailableError:
+                # not on this transport, it fails before sending anything
+                return False
+        return True
+
+    def finish(self):
+        if not self.sent:
+            self.write(b"")
+        if self.chunked:
+            self.protocol.send(b"0\r\n\r\n")
+
+
+class HTTPProtocol(asyncio.Protocol):
+    """
+    A client connection, requests are handled one after the other.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.loop = server.loop
+        self.transport = None
+        self.buffer = bytearray()
+        self.request = None
+        self.reader = None
+        # set while receiving a chunked request body
+        self.decoder = None
+        # a request is dispatched to the application
+        self.busy = False
+        self.closed = False
+        self.eof = False
+        self.paused = False
+        self.timer = None
+        self.writable = threading.Event()
+        self.writable.set()
+
+    # event loop side
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.set_timer(KEEPALIVE_TIMEOUT)
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.cancel_timer()
+        if self.reader is not None:
+            self.reader.abort()
+        # don't let the application wait for a client that is gone
+        self.writable.set()
+
+    def pause_writing(self):
+        self.writable.clear()
+
+    def resume_writing(self):
+        self.writable.set()
+
+    def data_received(self, data):
+        if self.decoder is not None:
+            return self.receive_chunked(data)
+        if self.reader is not None and not self.reader.complete:
+            part = data[:self.reader.remaining]
+            data = data[len(part):]
+            self.reader.feed(part)
+            if not self.busy and (self.reader.complete or len(
+                    self.reader.buffer) >= BODY_BUFFER_SIZE):
+                self.dispatch()
+        if data:
+            if not self.buffer and not self.busy:
+                # a new request begins, it must arrive in time
+                self.set_timer(REQUEST_TIMEOUT)
+            self.buffer.extend(data)
+            if not self.busy and self.reader is None:
+                self.parse()
+        self.pause()
+
+    def eof_received(self):
+        self.eof = True
+        if self.reader is not None and not self.reader.complete:
+            self.reader.abort()
+        if self.decoder is not None:
+            self.transport.close()
+            return True
+        if not self.busy:
+            self.transport.close()
+        # keep writing the response when busy
+        return True
+
+    def set_timer(self, timeout):
+        self.cancel_timer()
+        self.timer = self.loop.call_later(timeout, self.on_timeout)
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def on_timeout(self):
+        self.timer = None
+        if self.buffer or self.reader is not None or \
+                self.decoder is not None:
+            self.reject(408)
+        else:
+            self.transport.close()
+
+    def _full(self):
+        if len(self.buffer) > MAX_HEADER_SIZE:
+            return True
+        reader = self.reader
+        return reader is not None and not reader.waiting and \
+            len(reader.buffer) >= BODY_BUFFER_SIZE
+
+    def pause(self):
+        if self._full() and not self.paused and not self.closed:
+            self.paused = True
+            self.transport.pause_reading()
+
+    def resume(self):
+        if not self.paused or self.closed or self._full():
+            return
+        self.paused = False
+        self.transport.resume_reading()
+
+    def reject(self, code):
+        reason = _REASONS[code]
+        self.transport.write(
+            "HTTP/1.1 {0:d} {1}\r\nContent-Length: {2:d}\r\n"
+            "Connection: close\r\n\r\n{1}".format(
+                code, reason, len(reason)).encode('latin-1'))
+        self.transport.close()
+
+    def parse(self):
+        end = self.buffer.find(b"\r\n\r\n")
+        if end < 0:
+            if len(self.buffer) > MAX_HEADER_SIZE:
+                return self.reject(431)
+            return
+        if end > MAX_HEADER_SIZE:
+            return self.reject(431)
+        head = bytes(self.buffer[:end]).decode('latin-1')
+        del self.buffer[:end + 4]
+
+        lines = head.split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            return self.reject(400)
+        if version not in ("HTTP/1.0", "HTTP/1.1"):
+            return self.reject(505)
+
+        headers = []
+        for line in lines[1:]:
+            if line[:1] in (" ", "\t") and headers:
+                # obsolete line folding
+                headers[-1] = (headers[-1][0], headers[-1][1] + line.strip())
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                return self.reject(400)
+            headers.append((name.strip(), value.strip()))
+
+        environ = self.server.environ(self, method, target, version, headers)
+        encoding = environ.pop('HTTP_TRANSFER_ENCODING', "").lower()
+        chunked = encoding == 'chunked'
+        if encoding and not chunked:
+            return self.reject(501)
+        if chunked and 'CONTENT_LENGTH' in environ:
+            # ambiguous, as used to smuggle requests past proxies
+            return self.reject(400)
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return self.reject(400)
+
+        connection = environ.get('HTTP_CONNECTION', "").lower()
+        if version == "HTTP/1.1":
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        if (length or chunked) and environ.get('HTTP_EXPECT', "").lower() \
+                == '100-continue':
+            self.transport.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        self.request = (environ, Response(
+            self, version, method == "HEAD", keep_alive))
+        if chunked:
+            self.decoder = ChunkedDecoder()
+            data = bytes(self.buffer)
+            del self.buffer[:]
+            return self.receive_chunked(data)
+
+        self.reader = BodyReader(self, length)
+        environ['wsgi.input'] = self.reader
+        body = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        self.reader.feed(body)
+        if self.reader.complete or len(body) >= BODY_BUFFER_SIZE:
+            self.dispatch()
+        self.pause()
+
+    def receive_chunked(self, data):
+        try:
+            rest = self.decoder.feed(data)
+        except ValueError:
+            return self.reject(400)
+        if len(self.decoder.body) > MAX_CHUNKED_SIZE:
+            return self.reject(413)
+        if not self.decoder.finished:
+            # the body must keep coming
+            self.set_timer(REQUEST_TIMEOUT)
+            return
+        body = bytes(self.decoder.body)
+        self.decoder = None
+        # a pipelined request, parsed once this one is done
+        self.buffer.extend(rest)
+        environ = self.request[0]
+        environ['CONTENT_LENGTH'] = str(len(body))
+        self.reader = BodyReader(self, len(body))
+        environ['wsgi.input'] = self.reader
+        self.reader.feed(body)
+        self.dispatch()
+        self.pause()
+
+    def dispatch(self):
+        self.busy = True
+        self.cancel_timer()
+        environ, response = self.request
+        self.request = None
+        self.server.submit(self, environ, response)
+
+    def done(self, keep_alive):
+        self.busy = False
+        self.reader = None
+        if self.closed:
+            return
+        if not keep_alive or self.eof:
+            self.transport.close()
+            return
+        self.set_timer(KEEPALIVE_TIMEOUT)
+        self.resume()
+        if self.buffer:
+            # pipelined request
+            self.set_timer(REQUEST_TIMEOUT)
+            self.parse()
+
+    # application thread side
+
+    def call(self, func, *args):
+        if not self.closed:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def wait_writable(self):
+        # block while the client does not keep up, but not forever
+        if not self.writable.wait(IO_TIMEOUT):
+            self.call(self.transport.abort)
+            raise IOError("Timed out writing the response")
+        if self.closed:
+            raise IOError("Connection lost")
+
+    def send(self, data):
+        self.wait_writable()
+        self.call(self.transport.write, data)
+
+    def sendfile(self, filelike, offset, count):
+        end = offset + count
+        while offset < end:
+            size = min(SENDFILE_CHUNK_SIZE, end - offset)
+            self.wait_writable()
+            future = asyncio.run_coroutine_threadsafe(self.loop.sendfile(
+                self.transport, filelike, offset, size, fallback=False),
+                self.loop)
+            try:
+                sent = future.result(IO_TIMEOUT)
+            except FutureTimeoutError:
+                future.cancel()
+                self.call(self.transport.abort)
+                raise IOError("Timed out sending the file")
+            if sent < size:
+                # the file was truncated, the response can't be completed
+                raise IOError("File changed while sending")
+            offset += sent
+
+
+class AsyncWSGIServer(object):
+    """
+    Serve the wsgi application `app`, with at most `threads` requests
+    handled at once.
+
+    :param context: `ssl.SSLContext` to serve https
+    :param sock: listening socket to serve on, instead of binding `host`
+        and `port`
+    """
+    def __init__(self, app, host, port, threads, context=None, sock=None):
+        if sock is not None:
+            host, port = sock.getsockname()[:2]
+        self.app = app
+        self.sock = sock
+        self.host = host
+        self.port = port
+        self.context = context
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(threads)
+        self.loop = None
+        self.active = 0
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._base = {
+            'SERVER_NAME': host,
+            'SERVER_PORT': str(port),
+            'SCRIPT_NAME': "",
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': "https" if context else "http",
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper,
+        }
+
+    def environ(self, protocol, method, target, version, headers):
+        env = dict(self._base)
+        path, _, query = target.partition("?")
+        if "://" in path:
+            # absolute form, only the path is of interest
+            path = "/" + path.split("/", 3)[-1] if path.count("/") > 2 \
+                else "/"
+        env['REQUEST_METHOD'] = method
+        env['PATH_INFO'] = unquote(path, 'latin-1')
+        env['QUERY_STRING'] = query
+        env['SERVER_PROTOCOL'] = version
+        peer = protocol.transport.get_extra_info('peername')
+        if peer:
+            env['REMOTE_ADDR'] = peer[0]
+            env['REMOTE_PORT'] = str(peer[1])
+        for name, value in headers:
+            key = name.upper().replace("-", "_")
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = "HTTP_" + key
+            if key in env:
+                env[key] += "," + value
+            else:
+                env[key] = value
+        return env
+
+    def submit(self, protocol, environ, response):
+        with self._lock:
+            self.pending += 1
+        self.executor.submit(self.handle, protocol, environ, response)
+
+    def handle(self, protocol, environ, response):
+        with self._lock:
+            self.pending -= 1
+            self.active += 1
+        keep_alive = False
+        try:
+            result = self.app(environ, response.start_response)
+            try:
+                if not isinstance(result, FileWrapper) or \
+                        not response.sendfile(result.filelike):
+                    for data in result:
+                        if data:
+                            response.write(data)
+                response.finish()
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            # the rest of an unread body would be taken for a new request
+            keep_alive = response.keep_alive and protocol.reader.complete \
+                and not protocol.reader.buffer
+        except Exception:
+            if not response.sent and not protocol.closed:
+                environ['wsgi.errors'].write("Error handling request\n")
+                traceback.print_exc(file=environ['wsgi.errors'])
+                response.status = None
+                response.start_response(
+                    "500 Internal Server Error",
+                    [("Content-Type", "text/plain"),
+                     ("Content-Length", "21")])
+                response.keep_alive = False
+                try:
+                    response.write(b"Internal Server Error")
+                except IOError:
+                    pass
+        finally:
+            with self._lock:
+                self.active -= 1
+            protocol.call(protocol.done, keep_alive)
+
+    def serve_forever(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        if self.sock is not None:
+            server = self.loop.run_until_complete(self.loop.create_server(
+                lambda: HTTPProtocol(self), sock=self.sock,
+                ssl=self.context))
+        else:
+            server = self.loop.run_until_complete(self.loop.create_server(
+                lambda: HTTPProtocol(self), self.host, self.port,
+                ssl=self.context, backlog=1024))
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            self.executor.shutdown(wait=False)
+            self.loop.close()
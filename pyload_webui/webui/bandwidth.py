@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+from builtins import object, range
+from threading import Lock
+
+from future import standard_library
+
+standard_library.install_aliases()
+
+# size of the pieces the throttled bodies are sent in, smaller ones make the
+# rate smoother
+CHUNK_SIZE = 32 << 10
+
+# a bucket holds at least this much, so a piece never waits for more than
+# the bucket can hold
+MIN_BURST = 64 << 10
+
+
+class TokenBucket(object):
+    """
+    Allow `rate` bytes per second, in bursts of up to `burst` bytes, by
+    default a second worth; a rate of 0 is unlimited
+    """
+    __slots__ = ['_lock', 'burst', 'rate', 'stamp', 'tokens']
+
+    def __init__(self, rate, burst=None):
+        self._lock = Lock()
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0.0
+        self.stamp = time.time()
+        self.set_rate(rate, burst)
+
+    def _refill(self):
+        now = time.time()
+        if self.rate:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.burst = burst or max(rate, MIN_BURST)
+            self.tokens = min(self.tokens, self.burst)
+
+    def take(self, amount):
+        """
+        Take `amount` bytes, going into debt if there are not as many, so
+        concurrent takers queue up
+
+        :return: seconds to wait before sending them
+        """
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class ThrottledBody(object):
+    """
+    Response body sent at the pace of `buckets`, waiting in the thread
+    iterating it, between the pieces
+
+    :param body: iterable or file-like object
+    """
+    def __init__(self, body, buckets, throttle, chunk_size=CHUNK_SIZE):
+        self.body = body
+        self.buckets = buckets
+        self.throttle = throttle
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        body = self.body
+        if hasattr(body, 'read'):
+            body = iter(lambda: self.body.read(self.chunk_size), b"")
+        for data in body:
+            for start in range(0, len(data), self.chunk_size):
+                piece = data[start:start + self.chunk_size]
+                delay = max(bucket.take(len(piece))
+                            for bucket in self.buckets)
+                if delay > 0:
+                    self.throttle.delayed += delay
+                    time.sleep(delay)
+                yield piece
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+
+class Throttle(object):
+    """
+    Bandwidth the downloads may take, `limit` bytes per second in all and
+    `user_limit` for each user, 0 is unlimited. Changed limits apply to the
+    running downloads, except the ones started while there was none.
+    """
+    def __init__(self, limit=0, user_limit=0):
+        self.limit = limit
+        self.user_limit = user_limit
+        self.bucket = TokenBucket(limit)
+        self.users = {}
+        # seconds the downloads were held back
+        self.delayed = 0.0
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.limit or self.user_limit)
+
+    def configure(self, limit=None, user_limit=None):
+        with self._lock:
+            if limit is not None:
+                self.limit = limit
+                self.bucket.set_rate(limit)
+            if user_limit is not None:
+                self.user_limit = user_limit
+                for bucket in self.users.values():
+                    bucket.set_rate(user_limit)
+
+    def connection_limit(self):
+        """
+        :return: the lowest limit, for proxies only limiting connections
+        """
+        return min(limit for limit in (self.limit, self.user_limit) if limit)
+
+    def _buckets(self, user):
+        with self._lock:
+            bucket = self.users.get(user)
+            if bucket is None:
+                bucket = self.users[user] = TokenBucket(self.user_limit)
+        return [self.bucket, bucket]
+
+    def wrap(self, resp, user):
+        """
+        Throttle the body of the response `resp` to `user`; a throttled
+        file is read in pieces, not handed to the server
+        """
+        if not self.enabled or resp.status_code not in (200, 206):
+            return resp
+        resp.body = ThrottledBody(resp.body, self._buckets(user), self)
+        return resp
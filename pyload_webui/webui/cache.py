@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import time
+from builtins import object
+from collections import OrderedDict
+from threading import Lock
+
+from future import standard_library
+
+standard_library.install_aliases()
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping holding at most `maxsize` entries, the least recently
+    used are evicted first.
+
+    :param ttl: seconds after which an entry expires, None to keep it forever
+    """
+    __slots__ = ['evictions', 'hits', 'maxsize', 'misses', 'ttl', '_data',
+                 '_lock']
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                return default
+            # re-insert as most recently used
+            self._data[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            try:
+                return self._data.pop(key)[0]
+            except KeyError:
+                return default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def purge(self):
+        """
+        Remove the expired entries
+
+        :return: number of entries removed
+        """
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (value, expires) in self._data.items()
+                       if expires is not None and expires < now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+
+# callbacks to run after a successful call of an api method, by method name
+_listeners = {}
+
+
+def subscribe(funcs, callback):
+    """
+    Call `callback` every time one of the api methods `funcs` succeeded,
+    used to invalidate cached data depending on the core state
+    """
+    for func in funcs:
+        _listeners.setdefault(func, []).append(callback)
+
+
+def notify(func):
+    for callback in _listeners.get(func, ()):
+        callback()
@@ -18,6 +18,7 @@ from pyload.utils import purge
 from pyload.utils.fs import ulopen
 
 from .iface import API, DL_ROOT
+from .metrics import instrument
 
 standard_library.install_aliases()
 
@@ -47,12 +48,14 @@ def local_check(function):
 @route("/flash")
 @route("/flash/:id")
 @route("/flash", method="POST")
+@instrument()
 @local_check
 def flash(id="0"):
     return "JDownloader\n"
 
 
 @route("/flash/add", method="POST")
+@instrument()
 @local_check
 def add(request):
     package = request.POST.get('referer', None)
@@ -67,6 +70,7 @@ def add(request):
 
 
 @route("/flash/addcrypted", method="POST")
+@instrument()
 @local_check
 def addcrypted():
     package = request.forms.get('referer', 'ClickAndLoad Package')
@@ -85,6 +89,7 @@ def addcrypted():
 
 
 @route("/flash/addcrypted2", method="POST")
+@instrument()
 @local_check
 def addcrypted2():
 
@@ -134,6 +139,7 @@ def addcrypted2():
 @route("/flashgot_pyload", method="POST")
 @route("/flashgot")
 @route("/flashgot", method="POST")
+@instrument()
 @local_check
 def flashgot():
     if request.environ['HTTP_REFERER'] != "http://localhost:9666/flashgot" and request.environ[
@@ -155,6 +161,7 @@ def flashgot():
 
 
 @route("/crossdomain.xml")
+@instrument()
 @local_check
 def crossdomain():
     rep = "<?xml version=\"1.0\"?>\n"
@@ -166,6 +173,7 @@ def crossdomain():
 
 
 @route("/flash/checkSupportForUrl")
+@instrument()
 @local_check
 def checksupport():
 
@@ -177,6 +185,7 @@ def checksupport():
 
 
 @route("/jdcheck.js")
+@instrument()
 @local_check
 def jdcheck():
     rep = "jdownloader=true;\n"
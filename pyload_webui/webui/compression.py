@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals
+
+import zlib
+from builtins import int, object
+
+from future import standard_library
+
+from .iface import COMPRESS_LEVEL, COMPRESS_MIN_SIZE, load
+
+standard_library.install_aliases()
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# supported encodings, preferred ones first
+ENCODINGS = [name for name, available in (
+    ('br', brotli is not None),
+    ('zstd', zstandard is not None),
+    ('gzip', True),
+    ('deflate', True)) if available]
+
+# file extension of precompressed variants, preferred ones first
+EXTENSIONS = [('br', '.br'), ('zstd', '.zst'), ('gzip', '.gz')]
+
+# lowest and normal compression level of each encoding, the normal levels of
+# brotli and zstd are about as fast as gzip at its default level
+LEVELS = {
+    'br': (0, 4),
+    'deflate': (1, COMPRESS_LEVEL),
+    'gzip': (1, COMPRESS_LEVEL),
+    'zstd': (1, 3)}
+
+# levels for data compressed once and sent many times
+MAX_LEVELS = {'br': 11, 'deflate': 9, 'gzip': 9, 'zstd': 19}
+
+# server usage from which the compression level starts to be lowered
+BUSY_THRESHOLD = 0.5
+
+
+def parse_accept_encoding(header):
+    """
+    Parse an `Accept-Encoding` header
+
+    :return: dict of encodings with their q-value
+    """
+    result = {}
+    for item in header.split(","):
+        parts = item.split(";")
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, value = param.partition("=")
+            if key.strip().lower() != 'q':
+                continue
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        result[name] = q
+    return result
+
+
+def select_encoding(header, available=None, size=None):
+    """
+    Choose the best encoding acceptable by the client
+
+    :param header: value of the `Accept-Encoding` header
+    :param available: encodings to choose from, defaults to `ENCODINGS`
+    :param size: length of the data, small data is not worth to compress
+    :return: encoding name or None if the data should be sent as is
+    """
+    if not header or size is not None and size <= COMPRESS_MIN_SIZE:
+        return None
+    if available is None:
+        available = ENCODINGS
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*', 0.0)
+
+    best = None
+    best_q = 0.0
+    for name in available:
+        q = accepted.get(name, wildcard)
+        # on equal q-values the order of `available` is respected
+        if q > best_q:
+            best = name
+            best_q = q
+    return best
+
+
+def get_level(encoding):
+    """
+    Compression level to use with `encoding`, lowered as the server gets busy
+    """
+    low, level = LEVELS[encoding]
+    usage = load.usage
+    if usage > BUSY_THRESHOLD:
+        # scale down to the lowest level when all the workers are busy
+        ratio = min(1.0, (usage - BUSY_THRESHOLD) / (1 - BUSY_THRESHOLD))
+        level -= int(round((level - low) * ratio))
+    return max(low, level)
+
+
+class Compressor(object):
+    """
+    Incremental compressor with a common interface for all the encodings
+    """
+    __slots__ = ['_compress', '_flush']
+
+    def __init__(self, encoding, level=None):
+        if level is None:
+            level = get_level(encoding)
+
+        if encoding == 'gzip':
+            obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            obj = zlib.compressobj(level)
+        elif encoding == 'zstd':
+            obj = zstandard.ZstdCompressor(level=level).compressobj()
+        elif encoding == 'br':
+            obj = brotli.Compressor(quality=level)
+            self._compress = obj.process
+            self._flush = obj.finish
+            return
+        else:
+            raise ValueError("Unsupported encoding: {0}".format(encoding))
+
+        self._compress = obj.compress
+        self._flush = obj.flush
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def flush(self):
+        return self._flush()
+
+
+def compress(data, encoding, level=None):
+    c = Compressor(encoding, level)
+    return c.compress(data) + c.flush()
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import numbers
+import re
+import sys
+import types
+from builtins import dict, int, object, str
+
+from future import standard_library
+
+from pyload.rpc.jsonconverter import loads
+
+standard_library.install_aliases()
+
+try:
+    from inspect import getfullargspec as getargspec
+except ImportError:
+    from inspect import getargspec
+
+# parameters named like this are always ids
+INT_NAMES = frozenset(['aid', 'fid', 'iid', 'pid', 'tid', 'uid'])
+
+
+_WORD_START = re.compile(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+
+
+def snake_case(name):
+    """
+    Name of an api method as defined by the core, from the camel case one
+    used by the clients
+    """
+    return _WORD_START.sub("_", name).lower()
+
+
+class InvalidInput(ValueError):
+    pass
+
+
+def decode_json(value):
+    return loads(value)
+
+
+def decode_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        # also accepts json encoded integers, like "\"1\"", but no floats,
+        # which would be truncated
+        result = loads(value)
+        if isinstance(result, (str, type(""))):
+            return int(result)
+        if not isinstance(result, numbers.Integral) or \
+                isinstance(result, bool):
+            raise ValueError("not an integer")
+        return int(result)
+
+
+def decode_bool(value):
+    value = value.strip('"').lower()
+    if value in ('true', '1'):
+        return True
+    if value in ('false', '0'):
+        return False
+    raise ValueError("not a boolean")
+
+
+def decode_str(value):
+    # plain strings are accepted as well as json encoded ones
+    if value.startswith('"'):
+        return str(loads(value))
+    return value
+
+
+def get_decoder(name, default=None, annotation=None):
+    """
+    Choose how to decode the argument `name` from its annotation, its default
+    value or its name; json is the fallback
+    """
+    hint = annotation
+    if hint is None and default is not None:
+        hint = type(default)
+    if not isinstance(hint, type):
+        return decode_int if name in INT_NAMES else decode_json
+    if issubclass(hint, bool):
+        return decode_bool
+    if issubclass(hint, numbers.Integral):
+        return decode_int
+    if issubclass(hint, (str, type(""))):
+        return decode_str
+    return decode_json
+
+
+class Method(object):
+    """
+    Api method with the decoders of its arguments, built from the signature
+    of `func`
+
+    :param unbound: the function of the api class, called with the user api
+        context, None to look the method up on each call
+    :param perm: permission required to call it, None if not known
+    """
+    __slots__ = ['decoders', 'func', 'name', 'params', 'perm', 'required',
+                 'varargs', 'varkw']
+
+    def __init__(self, name, func, unbound=None, perm=None):
+        self.name = name
+        self.func = unbound
+        self.perm = perm
+        # look through decorators
+        while hasattr(func, '__wrapped__'):
+            func = func.__wrapped__
+        spec = getargspec(func)
+        params = list(spec.args)
+        if params and params[0] == 'self':
+            params = params[1:]
+        defaults = spec.defaults or ()
+        annotations = getattr(spec, 'annotations', {})
+        ndefaults = len(defaults)
+
+        self.params = params
+        self.required = params[:len(params) - ndefaults]
+        self.varargs = spec.varargs is not None
+        self.varkw = getattr(spec, 'varkw', getattr(spec, 'keywords', None))
+        self.varkw = self.varkw is not None
+        self.decoders = {}
+        for i, param in enumerate(params):
+            j = i - (len(params) - ndefaults)
+            default = defaults[j] if j >= 0 else None
+            self.decoders[param] = get_decoder(
+                param, default, annotations.get(param))
+
+    def _decode(self, name, value):
+        # null is None whatever the type, as when all was decoded as json
+        if value == "null":
+            return None
+        decoder = self.decoders.get(name, decode_json)
+        try:
+            return decoder(value)
+        except Exception as e:
+            raise InvalidInput(
+                "Invalid value for argument {0} of {1}: {2}".format(
+                    name, self.name, str(e)))
+
+    def decode(self, args, kwargs):
+        """
+        Decode the arguments given as strings and check they fit the method
+
+        :raises InvalidInput: on bad input, with an explanatory message
+        :return: tuple of decoded positional and keyword arguments
+        """
+        self._check_count(args)
+        dargs = [self._decode(name, value) for name, value in zip(
+            self.params, args)]
+        dargs.extend(self._decode(None, value)
+                     for value in args[len(self.params):])
+
+        dkwargs = {}
+        for name, value in kwargs.items():
+            if name not in self.decoders and not self.varkw and \
+                    name.startswith("_"):
+                # not meant for the api, like the cache buster of jquery
+                continue
+            self._check_name(name, args)
+            dkwargs[name] = self._decode(name, value)
+        return dargs, dkwargs
+
+    def _check_count(self, args):
+        if len(args) > len(self.params) and not self.varargs:
+            raise InvalidInput("{0} takes at most {1:d} arguments".format(
+                self.name, len(self.params)))
+
+    def _check_name(self, name, args):
+        if name not in self.decoders and not self.varkw:
+            raise InvalidInput("{0} got an unexpected argument {1}".format(
+                self.name, name))
+        if name in self.params[:len(args)]:
+            raise InvalidInput("{0} got multiple values for {1}".format(
+                self.name, name))
+
+    def check(self, args, kwargs):
+        """
+        Check that the arguments, decoded or given as json, fit the method
+
+        :raises InvalidInput: on missing, unexpected or repeated arguments
+        """
+        self._check_count(args)
+        for name in kwargs:
+            self._check_name(name, args)
+        given = set(self.params[:len(args)]).union(kwargs)
+        missing = [name for name in self.required if name not in given]
+        if missing:
+            raise InvalidInput("{0} is missing arguments: {1}".format(
+                self.name, ", ".join(missing)))
+
+    def allowed(self, user):
+        """
+        Check if `user` may call the method, like `API.is_authorized`
+
+        :return: None if the permission is not known
+        """
+        if user.is_admin():
+            return True
+        if self.perm is None:
+            return None
+        return bool(user.has_permission(self.perm))
+
+    def call(self, api, args, kwargs):
+        if self.func is None:
+            return getattr(api, self.name)(*args, **kwargs)
+        return self.func(api, *args, **kwargs)
+
+    def __getstate__(self):
+        # sent to the workers, which can't call into the core directly
+        state = dict((name, getattr(self, name)) for name in self.__slots__)
+        state['func'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+def _unbound(cls, name):
+    # plain functions only, anything else is looked up on each call
+    for klass in cls.__mro__:
+        if name in vars(klass):
+            value = vars(klass)[name]
+            return value if isinstance(value, types.FunctionType) else None
+    return None
+
+
+def build_table(api):
+    """
+    Collect the methods exposed by `api`, by name
+    """
+    # the api of another process brings the table built there
+    if getattr(api, 'table', None) is not None:
+        return dict(api.table)
+    # permissions required by the methods, as registered by the core
+    module = sys.modules.get(type(api).__module__)
+    perms = getattr(module, 'perm_map', None) or {}
+    table = {}
+    for name in dir(api.EXTERNAL):
+        if name.startswith("_"):
+            continue
+        func = getattr(api, name, None)
+        if not callable(func):
+            continue
+        # unbound, so it runs in the context of the user calling it
+        unbound = _unbound(type(api), name)
+        perm = perms.get(name)
+        try:
+            table[name] = Method(name, func, unbound, perm)
+        except TypeError:
+            # not introspectable, accept anything
+            table[name] = Method(
+                name, lambda *args, **kwargs: None, unbound, perm)
+    return table
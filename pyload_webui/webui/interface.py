@@ -13,11 +13,13 @@ from pkg_resources import resource_exists, resource_filename
 import bottle
 from pyload.core.thread import webserver as ServerThread  # TODO: Recheck...
 # Last routes to register
-from pyload.webui import api, cnl, pyload, setup
+from pyload.webui import admin, api, cnl, pyload, setup
 
 from .__about__ import __package__
-from .middlewares import (PrefixMiddleware, SessionMiddleware,
-                          StripPathMiddleware)
+from .middlewares import (LoadMiddleware, PrefixMiddleware,
+                          SessionMiddleware, StripPathMiddleware)
+from .profiling import StackSampler
+from .sessions import create_store, namespace_manager
 
 standard_library.install_aliases()
 
@@ -34,6 +36,22 @@ else:
     API = ServerThread.core.api
     config = ServerThread.core.config
 
+# served by a prefork worker, state kept in memory is not shared with the
+# other workers
+WORKER = getattr(ServerThread.core, 'worker', False)
+
+
+def get_option(option, default=None):
+    """
+    Get a webui config value, `default` is returned if the option is not set
+    """
+    try:
+        value = config.get('webui', option)
+    except Exception:
+        return default
+    return default if value is None else value
+
+
 TEMPLATE = "default"
 DL_ROOT = config.get('general', 'storage_folder')
 PREFIX = config.get('webui', 'prefix')
@@ -58,14 +76,99 @@ DEBUG = config.get(
     'webui', 'debug') or "-d" in sys.argv or "--debug" in sys.argv
 bottle.debug(DEBUG)
 
+# responses smaller than this are not compressed
+COMPRESS_MIN_SIZE = get_option('compress_min_size', 500)
+# gzip level used while the server is not busy
+COMPRESS_LEVEL = get_option('compress_level', 6)
+
+# request bodies over this size are spooled to disk
+UPLOAD_SPOOL_SIZE = get_option('upload_spool_size', 1 << 20)
+# larger request bodies are rejected
+UPLOAD_MAX_SIZE = get_option('upload_max_size', 64 << 20)
+bottle.BaseRequest.MEMFILE_MAX = UPLOAD_SPOOL_SIZE
+
+# memory used to keep the files of the webui
+ASSET_CACHE_SIZE = get_option('asset_cache_size', 32 << 20)
+# seconds the config rendered into the index page is cached
+INDEX_TTL = get_option('index_ttl', 60)
+
+# let the reverse proxy send the downloads and the webui files:
+# `x-accel-redirect` for nginx, `x-sendfile` for apache and lighttpd, empty
+# to send them from here
+OFFLOAD = (get_option('offload') or "").lower()
+# internal locations of nginx serving the storage folder and the webui
+# files, under the prefix
+OFFLOAD_DOWNLOADS = get_option('offload_downloads', '/_offload/downloads/')
+OFFLOAD_ASSETS = get_option('offload_assets', '/_offload/webui/')
+
+# bytes per second the downloads from the webui may take in all, and for
+# each user, 0 is unlimited; changed at runtime by `/api/_bandwidth`; not
+# available with multiple processes
+BANDWIDTH_LIMIT = get_option('bandwidth_limit', 0)
+BANDWIDTH_USER_LIMIT = get_option('bandwidth_user_limit', 0)
+
+# where profiles of single api calls are saved and how many are kept
+PROFILE_DIR = get_option('profile_dir', os.path.join('tmp', 'profiles'))
+PROFILE_KEEP = get_option('profile_keep', 20)
+# ratio of api calls randomly profiled, besides the requested ones
+PROFILE_RATE = get_option('profile_rate', 0.0)
+
+# sample the stacks of the webserver threads in background
+SAMPLER = get_option('sampler', False)
+sampler = StackSampler(get_option('sampler_interval', 0.01))
+
+# worker threads of the threaded server
+WORKERS = get_option('workers', 6)
+# threads it may grow to when requests wait, not more than workers, the
+# default, disables it
+WORKERS_MAX = get_option('workers_max', WORKERS)
+# seconds a thread has to be idle before the pool shrinks again
+WORKERS_IDLE_TIME = get_option('workers_idle_time', 60)
+
+# serve with this many processes, using every cpu core, when more than one;
+# the api tokens, admission control and bandwidth limits are disabled then
+PROCESSES = get_option('processes', 1)
+
+# one of `file`, `memory` or `sqlite`
+SESSION_STORE = get_option('session_store', 'file')
+# sessions expire after this many seconds of inactivity
+SESSION_TIMEOUT = get_option('session_timeout', 7 * 24 * 60 * 60)
+
+# api clients get signed tokens on login instead of session ids, not with
+# multiple processes, they couldn't be revoked in all of them
+API_TOKENS = get_option('api_tokens', False)
+# tokens expire after this many seconds, revoked ones before
+TOKEN_TTL = get_option('token_ttl', 24 * 60 * 60)
+# key to sign the tokens, a random one makes them valid until restart
+TOKEN_SECRET = get_option('token_secret') or os.urandom(32)
+
+# api calls handled at once, 0 disables the admission control, as multiple
+# processes do
+API_LIMIT = get_option('api_limit', 0)
+# calls waiting for a slot, the ones over are rejected
+API_QUEUE = get_option('api_queue', 64)
+# seconds a call may wait for a slot
+API_QUEUE_TIMEOUT = get_option('api_queue_timeout', 5.0)
+# calls a single user may run at once, the others wait for a slot
+API_USER_LIMIT = get_option('api_user_limit', 8)
+# same per client address, behind a reverse proxy all users share one
+API_IP_LIMIT = get_option('api_ip_limit', 0)
+
 session_opts = {
     'session.type': 'file',
     'session.cookie_expires': False,
     'session.data_dir': './tmp',
-    'session.auto': False
+    'session.auto': False,
+    'session.timeout': SESSION_TIMEOUT
 }
 
-session = SessionMiddleware(bottle.app(), session_opts)
+session_store = create_store(SESSION_STORE, session_opts['session.data_dir'])
+# the file backend is handled by beaker itself
+if SESSION_STORE != 'file':
+    session_opts['session.namespace_class'] = namespace_manager(session_store)
+
+load = LoadMiddleware(bottle.app())
+session = SessionMiddleware(load, session_opts)
 web = StripPathMiddleware(session)
 
 if PREFIX:
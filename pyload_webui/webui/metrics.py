@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import bisect
+import time
+from builtins import int, object, str
+from threading import Lock
+
+from future import standard_library
+
+from bottle import HTTPResponse, response
+
+standard_library.install_aliases()
+
+PREFIX = 'pyload_webui_'
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10,
+                1 << 20, 4 << 20, 16 << 20)
+
+
+class Histogram(object):
+
+    __slots__ = ['buckets', 'count', 'counts', 'sum']
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    return "{{{0}}}".format(",".join(
+        '{0}="{1}"'.format(key, str(value).replace("\\", "\\\\").replace(
+            '"', '\\"').replace("\n", "\\n")) for key, value in labels))
+
+
+class Registry(object):
+    """
+    Collect counters and histograms, keyed by name and labels; the text
+    exposition is only built when scraped, so recording stays cheap.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+        self._lock = Lock()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS):
+        key = (name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def gauge(self, name, func, labels=(), kind='gauge'):
+        """
+        Register a value read by calling `func` while scraping, left out
+        while it returns None
+
+        :param kind: metric type, `counter` for values kept elsewhere
+        """
+        self.gauges[(name, labels)] = (func, kind)
+
+    def _header(self, lines, name, kind, seen):
+        if name in seen:
+            return
+        seen.add(name)
+        if name in self.help:
+            lines.append("# HELP {0}{1} {2}".format(
+                PREFIX, name, self.help[name]))
+        lines.append("# TYPE {0}{1} {2}".format(PREFIX, name, kind))
+
+    def render(self):
+        """
+        :return: metrics in the prometheus text format
+        """
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (hist.buckets, list(hist.counts), hist.count, hist.sum))
+                for key, hist in self.histograms.items())
+        lines = []
+        seen = set()
+
+        for (name, labels), value in counters:
+            self._header(lines, name, 'counter', seen)
+            lines.append("{0}{1}{2} {3}".format(
+                PREFIX, name, _format_labels(labels), value))
+
+        for (name, labels), (buckets, counts, count, total) in histograms:
+            self._header(lines, name, 'histogram', seen)
+            cumulated = 0
+            for bound, n in zip(list(buckets) + ["+Inf"], counts):
+                cumulated += n
+                lines.append("{0}{1}_bucket{2} {3}".format(
+                    PREFIX, name, _format_labels(labels, [('le', bound)]),
+                    cumulated))
+            lines.append("{0}{1}_sum{2} {3}".format(
+                PREFIX, name, _format_labels(labels), total))
+            lines.append("{0}{1}_count{2} {3}".format(
+                PREFIX, name, _format_labels(labels), count))
+
+        for (name, labels), (func, kind) in sorted(self.gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            self._header(lines, name, kind, seen)
+            lines.append("{0}{1}{2} {3}".format(
+                PREFIX, name, _format_labels(labels), value))
+
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = Registry()
+registry.describe('requests_total', "Requests handled, by route and status")
+registry.describe(
+    'request_duration_seconds', "Time spent handling requests, by route")
+registry.describe('response_size_bytes', "Size of the responses, by route")
+registry.describe('serialize_duration_seconds', "Time spent encoding json")
+registry.describe(
+    'compress_duration_seconds', "Time spent compressing, by encoding")
+
+
+def _size(result):
+    if isinstance(result, HTTPResponse):
+        length = result.headers.get('Content-Length')
+        if length:
+            return int(length)
+        result = result.body
+    if isinstance(result, (bytes, str)):
+        return len(result)
+    # streamed
+    return None
+
+
+def _record(handler, func, status, duration, result):
+    route = (('handler', handler), ('func', func))
+    registry.inc('requests_total', route + (('status', status),))
+    registry.observe('request_duration_seconds', duration, route)
+    size = _size(result)
+    if size is not None:
+        registry.observe('response_size_bytes', size, route, SIZE_BUCKETS)
+
+
+def instrument(label=None):
+    """
+    Record count, status, size and latency of the decorated route
+
+    :param label: function of the route keyword arguments, returning
+        the value of the `func` label
+    """
+    def _dec(func):
+        handler = func.__name__
+
+        def _view(*args, **kwargs):
+            start = time.time()
+            name = label(kwargs) if label else ""
+            try:
+                result = func(*args, **kwargs)
+            except HTTPResponse as e:
+                # redirects and errors raised
+                _record(handler, name, e.status_code,
+                        time.time() - start, e)
+                raise
+            except Exception:
+                _record(handler, name, 500, time.time() - start, None)
+                raise
+            if isinstance(result, HTTPResponse):
+                status = result.status_code
+            else:
+                status = response.status_code
+            _record(handler, name, status, time.time() - start, result)
+            return result
+
+        _view.__name__ = handler
+        return _view
+
+    return _dec
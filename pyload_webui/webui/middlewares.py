@@ -4,6 +4,7 @@
 from __future__ import absolute_import, unicode_literals
 
 from builtins import object
+from threading import Lock
 
 from future import standard_library
 
@@ -37,3 +38,32 @@ class StripPathMiddleware(object):
     def __call__(self, e, h):
         e['PATH_INFO'] = e['PATH_INFO'].rstrip('/')
         return self.app(e, h)
+
+
+class LoadMiddleware(object):
+    """
+    Keep count of the requests being handled at the same time.
+    """
+    __slots__ = ['active', 'app', 'capacity', '_lock']
+
+    def __init__(self, app, capacity=1):
+        self.app = app
+        self.capacity = capacity
+        self.active = 0
+        self._lock = Lock()
+
+    @property
+    def usage(self):
+        """
+        Ratio of busy workers, `capacity` is set by the server adapter
+        """
+        return self.active / float(max(1, self.capacity))
+
+    def __call__(self, e, h):
+        with self._lock:
+            self.active += 1
+        try:
+            return self.app(e, h)
+        finally:
+            with self._lock:
+                self.active -= 1
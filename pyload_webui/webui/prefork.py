@@ -0,0 +1,560 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-fork mode: the webui is served by several worker processes sharing the
+listening port, each reaching the core over a local connection to the
+broker running in the core process. POSIX only.
+
+State kept in memory is not shared by the workers, so the api tokens, the
+admission control and the bandwidth limits are disabled, the users and
+their permissions are not cached and `/api/_metrics` is not available.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import argparse
+import binascii
+import logging
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from builtins import dict, int, object, str
+from multiprocessing.connection import Client, Listener
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import (ServerHandler, WSGIRequestHandler,
+                                   WSGIServer)
+
+from future import standard_library
+
+from .servers import ssl_context
+from .sessions import Sweeper
+
+standard_library.install_aliases()
+
+log = logging.getLogger()
+
+AUTHKEY_ENV = 'PYLOAD_WEBUI_AUTHKEY'
+
+# seconds a worker must run to be considered started successfully, and the
+# longest delay between restarts of a worker crashing over and over
+MIN_UPTIME = 5
+MAX_BACKOFF = 30
+
+# size of the pieces uploaded files are passed to the broker in
+UPLOAD_CHUNK_SIZE = 256 << 10
+
+
+class Upload(object):
+    """
+    Stand-in for a file argument of an api call, its content follows the
+    call on the connection to the broker
+    """
+    __slots__ = []
+
+
+def listen(host, port, reuse_port=False, backlog=128):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+class Broker(object):
+    """
+    Execute the core calls of the workers, one thread per connection.
+
+    :param hello: what the workers get when connecting, see `create_broker`
+    :param spool_size: uploaded files over this size are kept on disk
+    """
+    def __init__(self, api, config, hello, spool_size=1 << 20):
+        self.api = api
+        self.config = config
+        self.hello = hello
+        self.spool_size = spool_size
+        self.authkey = os.urandom(32)
+        self.path = os.path.join(tempfile.mkdtemp(prefix="pyload-"), "broker")
+        self.listener = Listener(self.path, 'AF_UNIX', authkey=self.authkey)
+
+    def start(self):
+        thread = threading.Thread(target=self.accept)
+        thread.daemon = True
+        thread.start()
+
+    def accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except Exception as e:
+                # failed authentication or handshake
+                log.debug("Broker connection refused: {0}".format(str(e)))
+                continue
+            thread = threading.Thread(target=self.serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, conn):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                    files = self.receive_uploads(conn, request)
+                except (EOFError, IOError):
+                    break
+                try:
+                    reply = (True, self.handle(*request))
+                except Exception as e:
+                    reply = (False, e)
+                finally:
+                    for fp in files:
+                        fp.close()
+                try:
+                    conn.send(reply)
+                except (IOError, EOFError):
+                    break
+                except Exception as e:
+                    # not picklable, nothing was sent yet
+                    conn.send((False, Exception(str(e))))
+        finally:
+            conn.close()
+
+    def receive_uploads(self, conn, request):
+        """
+        Replace the `Upload` arguments of `request` by the files following
+        it, in place
+
+        :return: the files received
+        """
+        args, kwargs = request[3], request[4]
+        files = []
+
+        def receive(value):
+            if not isinstance(value, Upload):
+                return value
+            fp = tempfile.SpooledTemporaryFile(self.spool_size)
+            files.append(fp)
+            while True:
+                data = conn.recv_bytes()
+                if not data:
+                    break
+                fp.write(data)
+            fp.seek(0)
+            return fp
+
+        request[3] = [receive(arg) for arg in args]
+        for key, value in kwargs.items():
+            kwargs[key] = receive(value)
+        return files
+
+    def handle(self, kind, uid=None, name=None, args=(), kwargs={}):
+        if kind == 'hello':
+            return self.hello
+        if kind == 'config':
+            return self.config.get(*args)
+        if kind == 'user':
+            api = self.api.with_user_context(uid)
+            return None if api is None else api.user
+        if kind == 'api':
+            if name.startswith("_"):
+                raise AttributeError(name)
+            api = self.api
+            if uid is not None:
+                api = self.api.with_user_context(uid)
+                if api is None:
+                    raise Exception("Unknown user: {0}".format(uid))
+            return getattr(api, name)(*args, **kwargs)
+        raise ValueError("Unknown request: {0}".format(kind))
+
+
+def create_broker():
+    """
+    Broker for the api of the running core
+    """
+    from pyload.webui import iface
+    from pyload.webui.api import DISPATCH
+
+    store = iface.SESSION_STORE
+    if store == 'memory':
+        # sessions must be shared by the workers
+        log.warning("Memory session store not available with multiple "
+                    "processes, using sqlite")
+        store = 'sqlite'
+    # every worker would have its own revoked tokens, slots and buckets
+    for option in ('api_tokens', 'api_limit', 'bandwidth_limit',
+                   'bandwidth_user_limit'):
+        if getattr(iface, option.upper()):
+            log.warning("Option {0} not available with multiple "
+                        "processes, disabled".format(option))
+    hello = {
+        # the signatures of the api methods can't be inspected remotely
+        'table': DISPATCH,
+        # the workers must agree on these
+        'overrides': {'webui': {
+            'session_store': store,
+            'token_secret': iface.TOKEN_SECRET,
+            'api_tokens': False,
+            'api_limit': 0,
+            'bandwidth_limit': 0,
+            'bandwidth_user_limit': 0}}}
+    return Broker(iface.API, iface.config, hello, iface.UPLOAD_SPOOL_SIZE)
+
+
+class Supervisor(object):
+    """
+    Start `processes` workers serving on `host`:`port` and restart the ones
+    exiting; blocks forever.
+
+    :param reuse_port: let every worker bind its own socket with
+        SO_REUSEPORT, so the kernel spreads the connections evenly,
+        instead of sharing the one of the supervisor
+    """
+    def __init__(self, broker, host, port, processes, threads=None,
+                 key=None, cert=None, reuse_port=True):
+        self.broker = broker
+        self.host = host
+        self.port = port
+        self.processes = processes
+        self.threads = threads
+        self.key = key
+        self.cert = cert
+        self.reuse_port = reuse_port and hasattr(socket, 'SO_REUSEPORT')
+        self.sock = None
+        # process, start time and delay before the next restart, by slot
+        self.workers = {}
+
+    def command(self):
+        args = [sys.executable, '-m', __name__,
+                '--broker', self.broker.path]
+        if self.reuse_port:
+            args.extend(['--host', self.host, '--port', str(self.port)])
+        else:
+            args.extend(['--fd', str(self.sock.fileno())])
+        if self.threads:
+            args.extend(['--threads', str(self.threads)])
+        if self.key and self.cert:
+            args.extend(['--key', self.key, '--cert', self.cert])
+        return args
+
+    def spawn(self, slot, backoff=0):
+        env = dict(os.environ)
+        env[AUTHKEY_ENV] = binascii.hexlify(self.broker.authkey).decode(
+            'ascii')
+        kwargs = {}
+        if self.sock is not None:
+            if hasattr(os, 'set_inheritable'):
+                kwargs['pass_fds'] = (self.sock.fileno(),)
+            else:
+                kwargs['close_fds'] = False
+        process = subprocess.Popen(self.command(), env=env, **kwargs)
+        self.workers[slot] = (process, time.time(), backoff)
+        log.debug("Started webui worker {0:d} (pid {1:d})".format(
+            slot, process.pid))
+
+    def run(self):
+        self.broker.start()
+        if not self.reuse_port:
+            self.sock = listen(self.host, self.port)
+        for slot in range(self.processes):
+            self.spawn(slot)
+        try:
+            while True:
+                time.sleep(1)
+                self.check()
+        finally:
+            self.stop()
+
+    def check(self):
+        now = time.time()
+        for slot, (process, started, backoff) in list(self.workers.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            if now - started >= MIN_UPTIME:
+                backoff = 0
+            elif now - started < backoff:
+                # wait before restarting a worker which did not come up
+                continue
+            else:
+                backoff = min(MAX_BACKOFF, backoff * 2 or 1)
+            log.warning("Webui worker {0:d} exited with code {1}, "
+                        "restarting".format(slot, code))
+            self.spawn(slot, backoff)
+
+    def stop(self):
+        for process, started, backoff in self.workers.values():
+            if process.poll() is None:
+                process.terminate()
+
+
+class RemoteApi(object):
+    """
+    Stand-in for the core api in the workers, forwarding every call to the
+    broker; `user` is set for the api in the context of a user.
+    """
+    def __init__(self, client, table, uid=None, user=None):
+        self._client = client
+        self._uid = uid
+        self.table = table
+        self.user = user
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            return self._client.call('api', self._uid, name, args, kwargs)
+
+        call.__name__ = str(name)
+        return call
+
+    def with_user_context(self, uid):
+        user = self._client.call('user', uid)
+        if user is None:
+            return None
+        return RemoteApi(self._client, self.table, uid, user)
+
+
+class RemoteConfig(object):
+
+    def __init__(self, client, overrides):
+        self._client = client
+        self._overrides = overrides
+
+    def get(self, section, option):
+        try:
+            return self._overrides[section][option]
+        except KeyError:
+            return self._client.call('config', args=(section, option))
+
+
+class RemoteCore(object):
+    # tells the webui it doesn't run in the core process, see `iface.WORKER`
+    worker = True
+
+    def __init__(self, client, hello):
+        self.api = RemoteApi(client, hello['table'])
+        self.config = RemoteConfig(client, hello['overrides'])
+
+
+class BrokerClient(object):
+    """
+    Connections to the broker, one per thread
+    """
+    def __init__(self, path, authkey):
+        self.path = path
+        self.authkey = authkey
+        self._local = threading.local()
+
+    @staticmethod
+    def _upload(value, files):
+        # files can't be pickled, they are sent after the call
+        if hasattr(value, 'read') and hasattr(value, 'seek'):
+            files.append(value)
+            return Upload()
+        return value
+
+    def call(self, kind, uid=None, name=None, args=(), kwargs={}):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = Client(
+                self.path, 'AF_UNIX', authkey=self.authkey)
+        files = []
+        args = [self._upload(arg, files) for arg in args]
+        kwargs = dict((key, self._upload(value, files))
+                      for key, value in kwargs.items())
+        try:
+            conn.send([kind, uid, name, args, kwargs])
+            for fp in files:
+                while True:
+                    data = fp.read(UPLOAD_CHUNK_SIZE)
+                    if not data:
+                        break
+                    conn.send_bytes(data)
+                conn.send_bytes(b"")
+            ok, result = conn.recv()
+        except (EOFError, IOError):
+            # the core is gone
+            self._local.conn = None
+            conn.close()
+            raise
+        if not ok:
+            raise result
+        return result
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """
+    Serve on an already listening socket, with at most `threads` requests
+    handled at once; when all are busy no connection is accepted, so the
+    other workers get them.
+    """
+    daemon_threads = True
+
+    def __init__(self, sock, app, threads, context=None):
+        WSGIServer.__init__(self, sock.getsockname()[:2], QuietHandler,
+                            bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.context = context
+        self.slots = threading.BoundedSemaphore(threads)
+        host, port = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+        self.set_app(app)
+
+    def get_request(self):
+        conn, addr = self.socket.accept()
+        if self.context is not None:
+            # the handshake is done in the request thread
+            conn = self.context.wrap_socket(
+                conn, server_side=True, do_handshake_on_connect=False)
+        return conn, addr
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        try:
+            ThreadingMixIn.process_request(self, request, client_address)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            if self.context is not None:
+                try:
+                    request.do_handshake()
+                except (ssl.SSLError, socket.error):
+                    self.shutdown_request(request)
+                    return
+            ThreadingMixIn.process_request_thread(
+                self, request, client_address)
+        finally:
+            self.slots.release()
+
+
+class SendfileHandler(ServerHandler):
+    """
+    Send the files of `wsgi.file_wrapper` with `sendfile`, from where they
+    are to the content length
+    """
+    connection = None
+
+    def sendfile(self):
+        if self.connection is None or \
+                isinstance(self.connection, ssl.SSLSocket) or \
+                not hasattr(self.connection, 'sendfile'):
+            return False
+        filelike = self.result.filelike
+        try:
+            filelike.fileno()
+            offset = filelike.tell()
+            count = int(self.headers['Content-Length'])
+        except (AttributeError, IOError, TypeError, ValueError):
+            return False
+        if not self.headers_sent:
+            self.send_headers()
+        self._flush()
+        if count:
+            sent = self.connection.sendfile(filelike, offset, count)
+            if sent < count:
+                raise IOError("File changed while sending")
+        self.bytes_sent += count
+        return True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def handle(self):
+        # as the base class, with the handler sending files
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        handler = SendfileHandler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+            multithread=True)
+        handler.request_handler = self
+        handler.connection = self.connection
+        handler.run(self.server.get_app())
+
+    def log_message(self, *args):
+        pass
+
+
+def watch_parent(parent):
+    # exit with the core, even if it could not stop the workers
+    while os.getppid() == parent:
+        time.sleep(1)
+    os._exit(0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pyLoad webui worker")
+    parser.add_argument('--broker', required=True)
+    parser.add_argument('--fd', type=int)
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--threads', type=int, default=6)
+    parser.add_argument('--key')
+    parser.add_argument('--cert')
+    args = parser.parse_args(argv)
+
+    thread = threading.Thread(target=watch_parent, args=(os.getppid(),))
+    thread.daemon = True
+    thread.start()
+
+    authkey = binascii.unhexlify(os.environ.pop(AUTHKEY_ENV))
+    client = BrokerClient(args.broker, authkey)
+    core = RemoteCore(client, client.call('hello'))
+
+    # must be in place before the webui is imported
+    from pyload.core.thread import webserver as ServerThread
+    ServerThread.core = core
+
+    from pyload.webui import iface
+
+    if args.fd is not None:
+        try:
+            # the address family is detected
+            sock = socket.socket(fileno=args.fd)
+        except TypeError:
+            sock = socket.fromfd(args.fd, socket.AF_INET, socket.SOCK_STREAM)
+    else:
+        sock = listen(args.host, args.port, reuse_port=True)
+
+    context = None
+    if args.key and args.cert:
+        context = ssl_context(args.cert, args.key)
+
+    # the store may not be the one of the core, see `create_broker`
+    Sweeper(iface.session_store, iface.SESSION_TIMEOUT).start()
+    if iface.SAMPLER:
+        iface.sampler.start()
+
+    iface.load.capacity = args.threads
+    try:
+        from .asyncserver import AsyncWSGIServer
+    except ImportError:
+        # no asyncio, one connection per request
+        server = ThreadingWSGIServer(sock, iface.web, args.threads, context)
+    else:
+        server = AsyncWSGIServer(iface.web, None, None, args.threads,
+                                 context, sock=sock)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
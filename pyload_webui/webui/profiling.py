@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, unicode_literals
+
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from builtins import int, object
+from threading import Lock
+
+from future import standard_library
+
+standard_library.install_aliases()
+
+_RE_PROFILE = re.compile(r'^(\d+)-(\w+)-(\d+)ms\.prof$')
+
+
+class ProfileRing(object):
+    """
+    Profile single calls on demand, keeping only the last `size` profiles
+    in `path`; file names hold time, function name and duration, so the
+    directory itself is the index.
+
+    :param rate: ratio of calls to profile when not explicitly requested
+    """
+    def __init__(self, path, size=20, rate=0.0):
+        self.path = path
+        self.size = size
+        self.rate = rate
+        # one profiler at a time, others calls are just not profiled
+        self._lock = Lock()
+
+    def wanted(self, requested=False):
+        return requested or self.rate > 0 and random.random() < self.rate
+
+    def capture(self, name, func, *args, **kwargs):
+        """
+        Call `func` under the profiler, saving its stats as `name`
+        """
+        if not self._lock.acquire(False):
+            return func(*args, **kwargs)
+        try:
+            profile = cProfile.Profile()
+            start = time.time()
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                duration = time.time() - start
+                self._save(profile, name, duration)
+        finally:
+            self._lock.release()
+
+    def _save(self, profile, name, duration):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        filename = "{0:d}-{1}-{2:d}ms.prof".format(
+            int(time.time() * 1000), re.sub(r'\W', '_', name),
+            int(duration * 1000))
+        profile.dump_stats(os.path.join(self.path, filename))
+        # drop the oldest ones
+        for entry in self.entries()[self.size:]:
+            try:
+                os.remove(os.path.join(self.path, entry['file']))
+            except OSError:
+                pass
+
+    def entries(self):
+        """
+        :return: list of the saved profiles, most recent first
+        """
+        if not os.path.isdir(self.path):
+            return []
+        result = []
+        for filename in os.listdir(self.path):
+            m = _RE_PROFILE.match(filename)
+            if m is None:
+                continue
+            result.append({
+                'file': filename,
+                'time': int(m.group(1)) / 1000,
+                'func': m.group(2),
+                'duration': int(m.group(3)) / 1000})
+        result.sort(key=lambda entry: entry['time'], reverse=True)
+        return result
+
+
+class StackSampler(threading.Thread):
+    """
+    Periodically snapshot the stacks of all the other threads, aggregated
+    as folded stacks (the input format of flamegraph.pl).
+
+    :param interval: seconds between samples
+    :param maxstacks: distinct stacks kept, further ones are counted apart
+    """
+    def __init__(self, interval=0.01, maxstacks=10000):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.interval = interval
+        self.maxstacks = maxstacks
+        self.samples = 0
+        self._stacks = {}
+        self._lock = Lock()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+
+    def sample(self):
+        names = dict((t.ident, re.sub(r'[\d\s-]+$', "", t.name))
+                     for t in threading.enumerate())
+        me = threading.current_thread().ident
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append("{0} ({1}:{2:d})".format(
+                    code.co_name, os.path.basename(code.co_filename),
+                    code.co_firstlineno))
+                frame = frame.f_back
+            frames.append(names.get(ident, "unknown"))
+            stacks.append(";".join(reversed(frames)))
+
+        with self._lock:
+            self.samples += 1
+            for stack in stacks:
+                if stack not in self._stacks and \
+                        len(self._stacks) >= self.maxstacks:
+                    stack = "[truncated]"
+                self._stacks[stack] = self._stacks.get(stack, 0) + 1
+
+    def folded(self, reset=False):
+        """
+        :return: one `frame;frame;... count` line per stack
+        """
+        with self._lock:
+            stacks = self._stacks
+            if reset:
+                self._stacks = {}
+                self.samples = 0
+            else:
+                stacks = dict(stacks)
+        return "".join("{0} {1:d}\n".format(stack, count)
+                       for stack, count in sorted(stacks.items()))
@@ -3,24 +3,60 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import hashlib
 import json
 import os
+import stat
 import time
 
 from future import standard_library
 
-from bottle import redirect, request, response, route, static_file, template
-
-from .iface import API, APPDIR, PREFIX, SETUP, UNAVAILABLE
+from bottle import (HTTPError, HTTPResponse, redirect, request, response,
+                    route, template)
+from pyload.core.datatype import ExceptionObject
+
+from . import compression
+from .assets import AssetCache, fresh
+from .cache import LRUCache, subscribe
+from .bandwidth import Throttle
+from .iface import (API, APPDIR, ASSET_CACHE_SIZE, BANDWIDTH_LIMIT,
+                    BANDWIDTH_USER_LIMIT, DEBUG, DL_ROOT, INDEX_TTL, OFFLOAD,
+                    OFFLOAD_ASSETS, OFFLOAD_DOWNLOADS, PREFIX, SETUP,
+                    UNAVAILABLE)
+from .metrics import instrument
+from .transfer import Offload, content_disposition, send_file
 from .utils import add_json_header, login_required, select_language
+from .zipstream import ZipStream, archive_name
 
 standard_library.install_aliases()
 
-# Cache file names that are available gzipped
-GZIPPED = {}
+# the reverse proxy sends the files, the internal locations are under the
+# prefix like the webui
+offload = None
+if OFFLOAD:
+    offload = Offload(OFFLOAD, [
+        (DL_ROOT, (PREFIX or "") + OFFLOAD_DOWNLOADS),
+        (APPDIR, (PREFIX or "") + OFFLOAD_ASSETS)])
+
+# bandwidth of the downloads
+throttle = Throttle(BANDWIDTH_LIMIT, BANDWIDTH_USER_LIMIT)
+
+# files of the webui, read once
+assets = AssetCache(APPDIR, max_total=ASSET_CACHE_SIZE, refresh=DEBUG,
+                    offload=offload)
 
+# api methods changing the config rendered into the index page
+CONFIG_CHANGES = ('save_config', 'set_config_value')
 
-@route('/icons/<path:filename>')
+# values rendered into the index page, fetched from the core; the ttl limits
+# staleness when the config is changed bypassing the webui
+_index_values = LRUCache(1, INDEX_TTL)
+subscribe(CONFIG_CHANGES, _index_values.clear)
+# rendered index pages, by those values
+_index_pages = LRUCache(4)
+
+
+@route('/icons/<filename:path>')
 def serve_icon(filename):
     # TODO: send real file, no redirects
     return redirect(PREFIX if PREFIX else '../images/icon.png')
@@ -28,11 +64,58 @@ def serve_icon(filename):
 
 
 @route("/download/:fid")
+@instrument()
 @login_required('Download')
 def download(fid, api):
     # TODO: check owner ship
     root, filename = api.get_file_path(fid)
-    return static_file(filename, root, download=True)
+    if offload is not None:
+        # files outside of the storage folder are sent from here
+        resp = offload.response(os.path.join(root, filename), download=True)
+        if resp is not None:
+            if throttle.enabled and offload.mode == 'x-accel-redirect':
+                # nginx can only limit each connection
+                resp.headers['X-Accel-Limit-Rate'] = str(
+                    throttle.connection_limit())
+            return resp
+    return throttle.wrap(send_file(filename, root, download=True),
+                         api.user.uid)
+
+
+@route("/download/package/:pid")
+@instrument()
+@login_required('Download')
+def download_package(pid, api):
+    try:
+        pack = api.get_package_info(int(pid))
+    except (ExceptionObject, ValueError):
+        return HTTPError(404, "Package does not exist.")
+
+    files = []
+    names = set()
+    for fid in pack.fids:
+        root, filename = api.get_file_path(fid)
+        path = os.path.join(root, filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            # not downloaded (yet)
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        name = archive_name(filename, names)
+        names.add(name)
+        files.append((name, path, st.st_size, st.st_mtime))
+    if not files:
+        return HTTPError(404, "Package has no files.")
+
+    archive = ZipStream(files)
+    headers = {
+        'Content-Type': "application/zip",
+        'Content-Length': str(archive.length),
+        'Content-Disposition': content_disposition(
+            "{0}.zip".format(pack.name or pid))}
+    return throttle.wrap(HTTPResponse(archive, **headers), api.user.uid)
 
 
 @route("/i18n")
@@ -48,6 +131,50 @@ def i18n(lang=None):
     return json.dumps({})
 
 
+def index_values():
+    """
+    :return: tuple of the values rendered into the index page
+    """
+    values = _index_values.get('values')
+    if values is None:
+        # set variable depending on setup mode
+        setup = 'false' if SETUP is None else 'true'
+        ws = API.get_ws_address() if API else False
+        external = API.get_config_value('webui', 'external') if API else None
+        web = None
+        if API:
+            web = API.get_config_value('webui', 'port')
+        elif SETUP:
+            web = SETUP.config.get('webui', 'port')
+        values = (ws, web, setup, external)
+        _index_values.set('values', values)
+    return values
+
+
+def render_index(asset):
+    """
+    :return: tuple of the entity tag and the dict of the rendered index page
+        by encoding, None for the uncompressed one
+    """
+    values = index_values()
+    # the file changes in development
+    key = (asset.original.etag,) + values
+    page = _index_pages.get(key)
+    if page is None:
+        ws, web, setup, external = values
+        # Render variables into the html page
+        data = template(asset.read().decode('utf-8'), ws=ws, web=web,
+                        setup=setup, external=external,
+                        prefix=PREFIX).encode('utf-8')
+        variants = {None: data}
+        for encoding in compression.ENCODINGS:
+            variants[encoding] = compression.compress(
+                data, encoding, compression.MAX_LEVELS[encoding])
+        page = (hashlib.sha1(data).hexdigest(), variants)
+        _index_pages.set(key, page)
+    return page
+
+
 @route('/')
 def index():
     # the browser should not set this, but remove in case to to avoid cached
@@ -58,64 +185,50 @@ def index():
     if UNAVAILABLE:
         return serve_static("unavailable.html")
 
-    resp = serve_static('index.html')
-    # set variable depending on setup mode
-    setup = 'false' if SETUP is None else 'true'
-    ws = API.get_ws_address() if API else False
-    external = API.get_config_value('webui', 'external') if API else None
-    web = None
-    if API:
-        web = API.get_config_value('webui', 'port')
-    elif SETUP:
-        web = SETUP.config.get('webui', 'port')
-
-    # Render variables into the html page
-    if resp.status_code == 200:
-        content = resp.body.read()
-        resp.body = template(content, ws=ws, web=web,
-                             setup=setup, external=external, prefix=PREFIX)
-        resp.content_length = len(resp.body) + 1
-
-    # these page should not be cached at all
-    resp.headers.append("Cache-Control", "no-cache")
-    # they are rendered and last modified would be wrong
-    if "Last-Modified" in resp.headers:
-        del resp.headers['Last-Modified']
-
-    return resp
+    asset = assets.get('index.html')
+    if asset is None:
+        return HTTPError(404, "File does not exist.")
+
+    digest, variants = render_index(asset)
+    encoding = compression.select_encoding(
+        request.get_header("Accept-Encoding"), compression.ENCODINGS,
+        len(variants[None]))
+    etag = '"{0}"'.format(digest) if encoding is None else \
+        '"{0}-{1}"'.format(digest, encoding)
+
+    headers = {
+        'ETag': etag,
+        'Vary': "Accept-Encoding",
+        # these page should not be cached at all, only revalidated
+        'Cache-Control': "no-cache"}
+    if fresh(etag):
+        return HTTPResponse(status=304, **headers)
+
+    body = variants[encoding]
+    headers['Content-Type'] = asset.mimetype
+    headers['Content-Length'] = str(len(body))
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return HTTPResponse(b"" if request.method == 'HEAD' else body, **headers)
 
 # Very last route that is registered, could match all uris
 
 
-@route('/<path:filename>')
+@route('/<filename:path>')
+@instrument()
 def serve_static(filename):
-    # save if this resource is available as gz
-    if filename not in GZIPPED:
-        GZIPPED[filename] = os.path.isfile(
-            os.path.join(APPDIR, filename + ".gz"))
-
-    # gzipped and clients accepts it
-    # TODO: index.html is not gzipped, because of template processing
-    gzipped = False
-    if GZIPPED[filename] and "gzip" in request.get_header(
-            "Accept-Encoding", "") and filename != "index.html":
-        gzipped = True
-        filename += ".gz"
-
-    resp = static_file(filename, root=APPDIR)
-
-    if filename.endswith(".html") or filename.endswith(".html.gz"):
+    # TODO: index.html is not compressed, because of template processing
+    resp = assets.serve(filename, encodings=filename != "index.html")
+
+    if filename.endswith(".html"):
         # tell the browser all html files must be revalidated
         resp.headers['Cache-Control'] = "must-revalidate"
-    elif resp.status_code == 200:
-        # expires after 7 days
+    elif resp.status_code in (200, 304) and \
+            'Cache-Control' not in resp.headers:
+        # expires after 7 days, fingerprinted files are kept for a year
         resp.headers['Expires'] = time.strftime(
             "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(
                 time.time() + 60 * 60 * 24 * 7))
         resp.headers['Cache-control'] = "public"
 
-    if gzipped:
-        resp.headers['Vary'] = 'Accept-Encoding'
-        resp.headers['Content-Encoding'] = 'gzip'
-
     return resp
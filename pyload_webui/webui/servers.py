@@ -2,6 +2,9 @@
 
 from __future__ import absolute_import, unicode_literals
 
+import os
+import threading
+import time
 from builtins import object, str
 
 from future import standard_library
@@ -11,19 +14,57 @@ from bottle import ServerAdapter as _ServerAdapter
 standard_library.install_aliases()
 
 
+def ssl_context(cert, key):
+    """
+    Server side context for https, with the protocols and ciphers the ssl
+    module considers secure
+    """
+    import ssl
+
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
 class ServerAdapter(_ServerAdapter):
 
-    __slots__ = ['cert', 'connection', 'debug', 'key']
+    __slots__ = ['cert', 'connection', 'debug', 'idle_time', 'key',
+                 'max_connection', 'on_resize', 'processes']
 
     SSL = False
     NAME = ""
 
-    def __init__(self, host, port, key, cert, connections, debug, **kwargs):
+    def __init__(self, host, port, key, cert, connections, debug,
+                 max_connections=None, idle_time=60, processes=None,
+                 **kwargs):
+        """
+        :param max_connections: size the worker pool may grow up to when
+            requests have to wait, None to keep `connections` workers
+        :param idle_time: seconds workers must be idle to be stopped again
+        :param processes: worker processes, for the servers forking
+        """
         _ServerAdapter.__init__(self, host, port, **kwargs)
         self.key = key
         self.cert = cert
         self.connection = connections
+        self.max_connection = max_connections
+        self.idle_time = idle_time
+        self.processes = processes
         self.debug = debug
+        # called with the new number of workers when the pool is resized
+        self.on_resize = None
+
+    @property
+    def autoscale(self):
+        return bool(self.max_connection) and \
+            self.max_connection > self.connection
+
+    def stats(self):
+        """
+        :return: dict of `workers`, `idle` workers and `queued` requests,
+            None when the server doesn't tell
+        """
+        return {'workers': self.connection, 'idle': None, 'queued': None}
 
     @classmethod
     def find(cls):
@@ -43,6 +84,48 @@ class ServerAdapter(_ServerAdapter):
         raise NotImplementedError
 
 
+class PoolMonitor(threading.Thread):
+    """
+    Resize the worker pool of a CherryPy server within its bounds: it grows
+    as soon as requests wait in the queue and shrinks back, one worker at a
+    time, once some workers have been idle for `idle_time` seconds.
+    """
+    def __init__(self, pool, idle_time=60, interval=0.5, on_resize=None):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.pool = pool
+        self.idle_time = idle_time
+        self.interval = interval
+        self.on_resize = on_resize
+        self.idle_since = None
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.check()
+
+    def check(self):
+        pool = self.pool
+        size = len(pool._threads)
+        queued = pool.qsize
+        if queued:
+            self.idle_since = None
+            # the pool does not grow over its max
+            pool.grow(queued)
+        elif pool.idle and size > pool.min:
+            now = time.time()
+            if self.idle_since is None:
+                self.idle_since = now
+            elif now - self.idle_since >= self.idle_time:
+                self.idle_since = now
+                pool.shrink(1)
+        else:
+            self.idle_since = None
+
+        if self.on_resize and len(pool._threads) != size:
+            self.on_resize(len(pool._threads))
+
+
 class CherryPyWSGI(ServerAdapter):
 
     SSL = True
@@ -52,6 +135,17 @@ class CherryPyWSGI(ServerAdapter):
     def find(cls):
         return True
 
+    def __init__(self, *args, **kwargs):
+        ServerAdapter.__init__(self, *args, **kwargs)
+        self.pool = None
+
+    def stats(self):
+        if self.pool is None:
+            return ServerAdapter.stats(self)
+        return {'workers': len(self.pool._threads),
+                'idle': self.pool.idle,
+                'queued': self.pool.qsize}
+
     def run(self, handler):
         from wsgiserver import CherryPyWSGIServer
 
@@ -59,7 +153,12 @@ class CherryPyWSGI(ServerAdapter):
             CherryPyWSGIServer.ssl_certificate = self.cert
             CherryPyWSGIServer.ssl_private_key = self.key
         server = CherryPyWSGIServer(
-            (self.host, self.port), handler, numthreads=self.connection)
+            (self.host, self.port), handler, numthreads=self.connection,
+            max=self.max_connection if self.autoscale else -1)
+        self.pool = server.requests
+        if self.autoscale:
+            PoolMonitor(self.pool, self.idle_time,
+                        on_resize=self.on_resize).start()
         server.start()
 
 
@@ -105,7 +204,6 @@ class MeinheldServer(ServerAdapter):
         server.run(handler)
 
 
-# TODO: ssl
 class TornadoServer(ServerAdapter):
     """
     The super hyped asynchronous server by facebook. Untested.
@@ -118,12 +216,46 @@ class TornadoServer(ServerAdapter):
         import tornado.httpserver
         import tornado.ioloop
 
+        ssl_options = None
+        if self.cert and self.key:
+            ssl_options = {'certfile': self.cert, 'keyfile': self.key}
         container = tornado.wsgi.WSGIContainer(handler)
-        server = tornado.httpserver.HTTPServer(container)
-        server.listen(port=self.port)
+        server = tornado.httpserver.HTTPServer(
+            container, ssl_options=ssl_options)
+        server.listen(port=self.port, address=self.host)
         tornado.ioloop.IOLoop.instance().start()
 
 
+class AsyncioServer(ServerAdapter):
+    """
+    Event loop handling the connections, the application runs in a pool
+    of `connections` threads; idle keep-alive connections cost no thread.
+    """
+    SSL = True
+    NAME = "asyncio"
+
+    def __init__(self, *args, **kwargs):
+        ServerAdapter.__init__(self, *args, **kwargs)
+        self.server = None
+
+    def stats(self):
+        if self.server is None:
+            return ServerAdapter.stats(self)
+        return {'workers': self.connection,
+                'idle': self.connection - self.server.active,
+                'queued': self.server.pending}
+
+    def run(self, handler):
+        from .asyncserver import AsyncWSGIServer
+
+        context = None
+        if self.cert and self.key:
+            context = ssl_context(self.cert, self.key)
+        self.server = AsyncWSGIServer(
+            handler, self.host, self.port, self.connection, context)
+        self.server.serve_forever()
+
+
 class BjoernServer(ServerAdapter):
     """
     Fast server written in C: https://github.com/jonashaag/bjoern.
@@ -175,7 +307,33 @@ class FlupFCGIServer(ServerAdapter):
         flup.server.fcgi.WSGIServer(handler, **self.options).run()
 
 
+class PreforkServer(ServerAdapter):
+    """
+    Several processes serving with `connections` threads each, they build
+    their own application and reach the core through a broker; they keep
+    the connections alive like the asyncio server, which they run where
+    it is available.
+    """
+    SSL = True
+    NAME = "prefork"
+
+    @classmethod
+    def find(cls):
+        return os.name == 'posix'
+
+    def run(self, handler):
+        from multiprocessing import cpu_count
+        from .prefork import Supervisor, create_broker
+
+        Supervisor(create_broker(), self.host, self.port,
+                   self.processes or cpu_count(), self.connection,
+                   self.key, self.cert).run()
+
+
 # Order is important and gives every server precedence over others!
-all_server = [TornadoServer, EventletServer, CherryPyWSGI]
+# prefork comes after the always available threaded one, so it is only used
+# when asked for
+all_server = [AsyncioServer, TornadoServer, EventletServer, CherryPyWSGI,
+              PreforkServer]
 # Some are deactivated because they have some flaws
 ##all_server = [FapwsServer, MeinheldServer, BjoernServer, TornadoServer, EventletServer, CherryPyWSGI]
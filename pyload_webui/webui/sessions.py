@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from builtins import object, range
+from collections import OrderedDict
+
+from future import standard_library
+
+from beaker.container import NamespaceManager
+from beaker.synchronization import null_synchronizer
+
+standard_library.install_aliases()
+
+log = logging.getLogger()
+
+# seconds the access time of a stored session may lag behind, so reading a
+# session is not a write every time
+TOUCH_INTERVAL = 60
+
+
+class SessionStore(object):
+    """
+    Storage of the session data, by session id.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, sid):
+        """
+        :raises KeyError: if there is no session `sid`
+        :return: dict of the session data
+        """
+        raise NotImplementedError
+
+    def set(self, sid, data):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def sweep(self, max_age):
+        """
+        Remove the sessions not accessed in the last `max_age` seconds
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expired': self.expired}
+
+
+class MemoryStore(SessionStore):
+    """
+    In-process store, split in shards with their own lock to keep contention
+    low; each shard evicts its least recently used sessions when full.
+    """
+    def __init__(self, maxsize=10000, shards=16):
+        SessionStore.__init__(self)
+        self.shard_size = max(1, maxsize // shards)
+        self._shards = [(threading.Lock(), OrderedDict())
+                        for _ in range(shards)]
+
+    def _shard(self, sid):
+        return self._shards[hash(sid) % len(self._shards)]
+
+    def __len__(self):
+        return sum(len(data) for lock, data in self._shards)
+
+    def get(self, sid):
+        lock, shard = self._shard(sid)
+        with lock:
+            try:
+                data = shard.pop(sid)[0]
+            except KeyError:
+                self.misses += 1
+                raise
+            shard[sid] = (data, time.time())
+            self.hits += 1
+        return data
+
+    def set(self, sid, data):
+        lock, shard = self._shard(sid)
+        with lock:
+            shard.pop(sid, None)
+            shard[sid] = (data, time.time())
+            while len(shard) > self.shard_size:
+                shard.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, sid):
+        lock, shard = self._shard(sid)
+        with lock:
+            shard.pop(sid, None)
+
+    def sweep(self, max_age):
+        threshold = time.time() - max_age
+        count = 0
+        for lock, shard in self._shards:
+            with lock:
+                # oldest first, stop at the first one still valid
+                for sid, (data, atime) in list(shard.items()):
+                    if atime >= threshold:
+                        break
+                    del shard[sid]
+                    count += 1
+        self.expired += count
+        return count
+
+
+class SQLiteStore(SessionStore):
+    """
+    Persistent store, the database is opened in WAL mode so readers don't
+    block each other nor the writer.
+    """
+    def __init__(self, path):
+        SessionStore.__init__(self)
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, data BLOB, atime REAL)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_atime "
+                "ON sessions (atime)")
+
+    def _connect(self):
+        # connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT data, atime FROM sessions WHERE id = ?",
+                (sid,)).fetchone()
+            if row is None:
+                self.misses += 1
+                raise KeyError(sid)
+            now = time.time()
+            if now - row[1] >= TOUCH_INTERVAL:
+                conn.execute(
+                    "UPDATE sessions SET atime = ? WHERE id = ?", (now, sid))
+        self.hits += 1
+        return pickle.loads(bytes(row[0]))
+
+    def set(self, sid, data):
+        blob = sqlite3.Binary(pickle.dumps(data, 2))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (sid, blob, time.time()))
+
+    def delete(self, sid):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def sweep(self, max_age):
+        with self._connect() as conn:
+            count = conn.execute(
+                "DELETE FROM sessions WHERE atime < ?",
+                (time.time() - max_age,)).rowcount
+        self.expired += count
+        return count
+
+
+class FileStore(SessionStore):
+    """
+    Only sweeps the files left by the beaker file backend, which does the
+    actual storage.
+    """
+    def __init__(self, data_dir):
+        SessionStore.__init__(self)
+        self.path = os.path.join(data_dir, 'container_file')
+
+    def sweep(self, max_age):
+        threshold = time.time() - max_age
+        count = 0
+        for root, dirs, files in os.walk(self.path):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < threshold:
+                        os.remove(path)
+                        count += 1
+                except OSError:
+                    pass
+        self.expired += count
+        return count
+
+
+def namespace_manager(store):
+    """
+    Create a beaker namespace manager class keeping its data in `store`
+    """
+    class StoreNamespaceManager(NamespaceManager):
+
+        def __init__(self, namespace, **kwargs):
+            NamespaceManager.__init__(self, namespace)
+
+        def _load(self):
+            try:
+                return store.get(self.namespace)
+            except KeyError:
+                return {}
+
+        def get_creation_lock(self, key):
+            return null_synchronizer()
+
+        def do_remove(self):
+            store.delete(self.namespace)
+
+        def __getitem__(self, key):
+            return self._load()[key]
+
+        def __contains__(self, key):
+            return key in self._load()
+
+        def __setitem__(self, key, value):
+            data = dict(self._load())
+            data[key] = value
+            store.set(self.namespace, data)
+
+        def __delitem__(self, key):
+            data = dict(self._load())
+            del data[key]
+            if data:
+                store.set(self.namespace, data)
+            else:
+                store.delete(self.namespace)
+
+        def keys(self):
+            return list(self._load().keys())
+
+    return StoreNamespaceManager
+
+
+class Sweeper(threading.Thread):
+    """
+    Periodically remove the expired sessions from the store.
+    """
+    def __init__(self, store, max_age, interval=10 * 60):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.store = store
+        self.max_age = max_age
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.store.sweep(self.max_age)
+            except Exception as e:
+                log.warning("Could not sweep the expired sessions: {0}".format(
+                    str(e)))
+
+
+def create_store(kind, data_dir, maxsize=10000):
+    """
+    :param kind: one of `file`, `memory` or `sqlite`
+    """
+    if kind == 'memory':
+        return MemoryStore(maxsize)
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    if kind == 'sqlite':
+        return SQLiteStore(os.path.join(data_dir, 'sessions.db'))
+    if kind == 'file':
+        return FileStore(data_dir)
+    raise ValueError("Unknown session store: {0}".format(kind))
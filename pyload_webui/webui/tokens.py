@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import time
+from builtins import int, object, str
+from threading import Lock
+
+from future import standard_library
+
+standard_library.install_aliases()
+
+
+def is_token(value):
+    # session ids are plain hex strings
+    return value.count(".") == 3
+
+
+class TokenManager(object):
+    """
+    Issue and validate signed session tokens, in the form
+    `uid.issued.nonce.signature`, so no session store has to be looked up.
+
+    :param secret: key used to sign, tokens are valid until it changes
+    :param ttl: seconds a token is valid after being issued
+    """
+    __slots__ = ['secret', 'ttl', '_lock', '_revoked']
+
+    def __init__(self, secret, ttl):
+        if not isinstance(secret, bytes):
+            secret = secret.encode('utf-8')
+        self.secret = secret
+        self.ttl = ttl
+        self._lock = Lock()
+        # nonces of revoked tokens and when they expire anyway
+        self._revoked = {}
+
+    def _sign(self, payload):
+        digest = hmac.new(
+            self.secret, payload.encode('utf-8'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).decode('ascii').rstrip("=")
+
+    def issue(self, uid):
+        nonce = binascii.hexlify(os.urandom(8)).decode('ascii')
+        payload = "{0:d}.{1:d}.{2}".format(uid, int(time.time()), nonce)
+        return "{0}.{1}".format(payload, self._sign(payload))
+
+    def _parse(self, token):
+        """
+        :return: tuple of uid, issue time and nonce, None if invalid
+        """
+        try:
+            payload, signature = str(token).rsplit(".", 1)
+            uid, issued, nonce = payload.split(".")
+            uid, issued = int(uid), int(issued)
+        except ValueError:
+            return None
+        # as bytes, strings with non-ascii characters can't be compared
+        if not hmac.compare_digest(self._sign(payload).encode('utf-8'),
+                                   signature.encode('utf-8')):
+            return None
+        if issued + self.ttl < time.time():
+            return None
+        return uid, issued, nonce
+
+    def validate(self, token):
+        """
+        :return: uid of the token owner, None if invalid or revoked
+        """
+        parsed = self._parse(token)
+        if parsed is None or parsed[2] in self._revoked:
+            return None
+        return parsed[0]
+
+    def revoke(self, token):
+        parsed = self._parse(token)
+        if parsed is None:
+            return
+        now = time.time()
+        with self._lock:
+            # no need to remember tokens expired in the meantime
+            for nonce, expires in list(self._revoked.items()):
+                if expires < now:
+                    del self._revoked[nonce]
+            self._revoked[parsed[2]] = parsed[1] + self.ttl
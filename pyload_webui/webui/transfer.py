@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Sending of large files: conditional and range requests, including
+multiple ranges as `multipart/byteranges`, so transfers can be resumed and
+split over several connections.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import binascii
+import errno
+import mimetypes
+import os
+import time
+from builtins import int, object, str
+from urllib.parse import quote
+
+from future import standard_library
+
+from bottle import HTTPError, HTTPResponse, parse_date, request
+
+from .assets import fresh
+
+standard_library.install_aliases()
+
+# size of the blocks read when the file can not be handed to the server
+CHUNK_SIZE = 64 << 10
+
+# requests for more ranges, after merging the overlapping ones, get the
+# whole file instead
+MAX_RANGES = 32
+
+# headers handing a file to the reverse proxy, by offload mode
+OFFLOAD_HEADERS = {
+    'x-accel-redirect': 'X-Accel-Redirect',
+    'x-sendfile': 'X-Sendfile'}
+
+
+class FileRange(object):
+    """
+    File-like view of `length` bytes of the file `fp` from `start`, which
+    the server can send with `wsgi.file_wrapper`; `fileno`, `tell` and
+    `seek` are the ones of the file, so the server may as well send the
+    rest of the range from where it is with `sendfile`
+    """
+    __slots__ = ['fp', 'length', 'remaining', 'start']
+
+    def __init__(self, fp, start, length):
+        fp.seek(start)
+        self.fp = fp
+        self.start = start
+        self.length = length
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.fp.fileno()
+
+    def tell(self):
+        return self.fp.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.fp.seek(offset, whence)
+
+    def close(self):
+        self.fp.close()
+
+
+class ByteRanges(object):
+    """
+    Body of a `multipart/byteranges` response
+
+    :param parts: list of the header of each part with its range
+    """
+    def __init__(self, fp, parts, boundary):
+        self.fp = fp
+        self.parts = parts
+        self.boundary = boundary
+
+    @staticmethod
+    def head(boundary, mimetype, start, end, size):
+        return "\r\n--{0}\r\nContent-Type: {1}\r\nContent-Range: bytes " \
+            "{2:d}-{3:d}/{4:d}\r\n\r\n".format(
+                boundary, mimetype, start, end - 1, size).encode('latin-1')
+
+    @staticmethod
+    def tail(boundary):
+        return "\r\n--{0}--\r\n".format(boundary).encode('latin-1')
+
+    def __iter__(self):
+        for head, start, end in self.parts:
+            yield head
+            self.fp.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = self.fp.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    # truncated meanwhile, the length can't be kept
+                    raise IOError("File changed while sending")
+                remaining -= len(data)
+                yield data
+        yield self.tail(self.boundary)
+
+    def close(self):
+        self.fp.close()
+
+
+def parse_ranges(header, size):
+    """
+    Parse a `Range` header for a file of `size` bytes
+
+    :return: the sorted list of the satisfiable ranges, as start and end
+        offset, with the overlapping and adjacent ones merged; None if the
+        header is invalid and must be ignored
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last) or \
+                not (first or "0").isdigit() or not (last or "0").isdigit():
+            return None
+        if not first:
+            # suffix: the last bytes
+            length = int(last)
+            if length:
+                ranges.append((max(0, size - length), size))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < size:
+            end = int(last) + 1 if last else size
+            ranges.append((start, min(end, size)))
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range(etag, mtime):
+    """
+    :return: True if the range request applies to the current file
+    """
+    value = request.environ.get('HTTP_IF_RANGE', "").strip()
+    if not value:
+        return True
+    if value.startswith('"') or value.startswith("W/"):
+        # strong comparison, a weak tag never matches
+        return value == etag
+    date = parse_date(value)
+    # a date is only a strong validator if the file did not change within
+    # the second it names
+    return date is not None and date == int(mtime) and \
+        int(mtime) < time.time() - 1
+
+
+def _precondition(etag, mtime):
+    """
+    :return: False if `If-Match` or `If-Unmodified-Since` fail
+    """
+    match = request.environ.get('HTTP_IF_MATCH')
+    if match is not None:
+        tags = [tag.strip() for tag in match.split(",")]
+        return "*" in tags or etag in tags
+    since = request.environ.get('HTTP_IF_UNMODIFIED_SINCE')
+    if since:
+        since = parse_date(since.split(";")[0].strip())
+        return since is None or int(mtime) <= since
+    return True
+
+
+def content_disposition(filename):
+    # quoted ascii name for old clients, the exact one in the rfc 5987 form
+    fallback = filename.encode('ascii', 'replace').decode('ascii')
+    fallback = fallback.replace("\\", "_").replace('"', "_")
+    value = 'attachment; filename="{0}"'.format(fallback)
+    if fallback != filename:
+        value += "; filename*=UTF-8''{0}".format(
+            quote(filename.encode('utf-8')))
+    return value
+
+
+def send_file(filename, root, mimetype=None, download=False):
+    """
+    Respond with the file `filename` in `root`, like `bottle.static_file`,
+    answering conditional and range requests; the file is handed to the
+    server with `wsgi.file_wrapper`, if it has one.
+
+    :param mimetype: guessed from the name if not given
+    :param download: send as attachment, under the original name or the
+        one given
+    """
+    root = os.path.join(os.path.abspath(root), "")
+    path = os.path.abspath(os.path.join(root, filename.strip("/\\")))
+    if not path.startswith(root):
+        return HTTPError(403, "Access denied.")
+    try:
+        fp = open(path, 'rb')
+        stat = os.fstat(fp.fileno())
+    except (IOError, OSError) as e:
+        if e.errno in (errno.EACCES, errno.EPERM):
+            return HTTPError(403, "You do not have permission to access "
+                                  "this file.")
+        return HTTPError(404, "File does not exist.")
+    size = stat.st_size
+    mtime = stat.st_mtime
+
+    # changes with any write, and if the file is replaced
+    etag = '"{0:x}-{1:x}-{2:x}"'.format(
+        stat.st_ino, size, int(mtime * 1000000))
+    headers = {
+        'Accept-Ranges': "bytes",
+        'ETag': etag,
+        'Last-Modified': time.strftime(
+            "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(mtime))}
+
+    if not _precondition(etag, mtime):
+        fp.close()
+        return HTTPResponse(status=412, **headers)
+    if fresh(etag, mtime):
+        fp.close()
+        return HTTPResponse(status=304, **headers)
+
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(path)[0] or \
+            'application/octet-stream'
+    if download:
+        name = download if download is not True else os.path.basename(path)
+        headers['Content-Disposition'] = content_disposition(name)
+
+    ranges = None
+    header = request.environ.get('HTTP_RANGE')
+    if header and _if_range(etag, mtime):
+        ranges = parse_ranges(header, size)
+        if ranges is not None and len(ranges) > MAX_RANGES:
+            ranges = None
+
+    if ranges == []:
+        fp.close()
+        headers['Content-Range'] = "bytes */{0:d}".format(size)
+        return HTTPResponse(status=416, **headers)
+
+    if ranges is None:
+        headers['Content-Type'] = mimetype
+        headers['Content-Length'] = str(size)
+        return HTTPResponse(fp, **headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Type'] = mimetype
+        headers['Content-Range'] = "bytes {0:d}-{1:d}/{2:d}".format(
+            start, end - 1, size)
+        headers['Content-Length'] = str(end - start)
+        return HTTPResponse(FileRange(fp, start, end - start), status=206,
+                            **headers)
+
+    boundary = binascii.hexlify(os.urandom(16)).decode('ascii')
+    parts = [(ByteRanges.head(boundary, mimetype, start, end, size),
+              start, end) for start, end in ranges]
+    length = len(ByteRanges.tail(boundary)) + sum(
+        len(head) + end - start for head, start, end in parts)
+    headers['Content-Type'] = "multipart/byteranges; boundary={0}".format(
+        boundary)
+    headers['Content-Length'] = str(length)
+    return HTTPResponse(ByteRanges(fp, parts, boundary), status=206,
+                        **headers)
+
+
+class Offload(object):
+    """
+    Let the reverse proxy send the files, answering only with a header
+    naming them: the proxy handles ranges, conditional requests and slow
+    clients without tying up a worker.
+
+    :param mode: `x-accel-redirect` for nginx, the files are named by the
+        uri of an internal location; `x-sendfile` for apache and lighttpd,
+        by their path
+    :param locations: list of directories, with the uri of the internal
+        location serving each of them for `x-accel-redirect`
+    """
+    def __init__(self, mode, locations):
+        if mode not in OFFLOAD_HEADERS:
+            raise ValueError("Unknown offload mode: {0}".format(mode))
+        self.mode = mode
+        self.header = OFFLOAD_HEADERS[mode]
+        self.locations = [
+            (os.path.join(os.path.abspath(root), ""), uri.rstrip("/") + "/")
+            for root, uri in locations]
+
+    def target(self, path):
+        """
+        :return: what the proxy is told to send for `path`, None if it has
+            no location for it
+        """
+        path = os.path.abspath(path)
+        for root, uri in self.locations:
+            if not path.startswith(root):
+                continue
+            if self.mode == 'x-sendfile':
+                # headers are latin-1, the proxy gets the bytes of the path
+                return path.encode('utf-8').decode('latin-1')
+            relpath = os.path.relpath(path, root).replace(os.sep, "/")
+            return uri + quote(relpath.encode('utf-8'))
+        return None
+
+    def response(self, path, mimetype=None, download=False, headers=None):
+        """
+        :param download: send as attachment, under the original name or the
+            one given
+        :param headers: more headers for the proxy to send along
+        :return: the response handing `path` to the proxy, None if it can't
+        """
+        target = self.target(path)
+        if target is None:
+            return None
+        headers = dict(headers or {})
+        headers[self.header] = target
+        headers['Content-Type'] = mimetype or mimetypes.guess_type(
+            path)[0] or 'application/octet-stream'
+        if download:
+            name = download if download is not True else \
+                os.path.basename(path)
+            headers['Content-Disposition'] = content_disposition(name)
+        return HTTPResponse(b"", **headers)
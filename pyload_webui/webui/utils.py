@@ -3,15 +3,27 @@
 from __future__ import absolute_import, unicode_literals
 
 import re
+from builtins import object
 
 from future import standard_library
 
 from bottle import HTTPError, redirect, request
 
-from .iface import API, SETUP
+from .cache import LRUCache, subscribe
+from .iface import API, SETUP, WORKER
 
 standard_library.install_aliases()
 
+# api methods changing users, their role or permissions
+USER_CHANGES = ('add_user', 'change_password', 'remove_user', 'set_password',
+                'set_user_permission', 'update_user_data')
+
+# user api contexts and their authorized methods, by uid; the ttl limits
+# staleness when users are modified bypassing the webui; prefork workers keep
+# none, like the credentials in `api`
+_contexts = LRUCache(0 if WORKER else 100, 5 * 60)
+subscribe(USER_CHANGES, _contexts.clear)
+
 
 def add_json_header(r):
     r.headers.replace("Content-type", "application/json")
@@ -32,10 +44,66 @@ def get_user_api(ses):
     if ses:
         uid = ses.get("uid", None)
         if uid is not None and API is not None:
-            return API.with_user_context(uid)
+            entry = _contexts.get(uid)
+            if entry is None:
+                api = API.with_user_context(uid)
+                if api is None:
+                    return None
+                entry = (api, {})
+                _contexts.set(uid, entry)
+            return entry[0]
     return None
 
 
+def is_authorized(api, func):
+    """
+    Like `API.is_authorized`, but cached along with the user api context
+    """
+    entry = _contexts.get(api.user.uid)
+    # context not cached (anymore)
+    if entry is None or entry[0] is not api:
+        return API.is_authorized(func, api.user)
+    allowed = entry[1]
+    if func not in allowed:
+        allowed[func] = API.is_authorized(func, api.user)
+    return allowed[func]
+
+
+class LimitedReader(object):
+    """
+    Wrap a file object, aborting the request with 413 as soon as more than
+    `limit` bytes are read from it.
+    """
+    __slots__ = ['fp', 'limit', 'count']
+
+    def __init__(self, fp, limit):
+        self.fp = fp
+        self.limit = limit
+        self.count = 0
+
+    def _check(self, data):
+        self.count += len(data)
+        if self.count > self.limit:
+            raise HTTPError(413, "Request Entity Too Large")
+        return data
+
+    def read(self, *args):
+        return self._check(self.fp.read(*args))
+
+    def readline(self, *args):
+        return self._check(self.fp.readline(*args))
+
+
+def limit_request_body(limit):
+    """
+    Enforce `limit` on the size of the request body, also for chunked ones
+    """
+    if request.content_length > limit:
+        raise HTTPError(413, "Request Entity Too Large")
+    request.environ['wsgi.input'] = LimitedReader(
+        request.environ['wsgi.input'], limit)
+
+
 def is_mobile():
     if request.get_cookie("mobile"):
         if request.get_cookie("mobile") == "True":
@@ -89,8 +157,9 @@ def login_required(perm=None):
             s = request.environ.get('beaker.session')
             api = get_user_api(s)
             if api is not None:
-                if perm:
-                    if api.user.has_permission(perm):
+                # admins are allowed anything, like by the core
+                if perm and not api.user.is_admin():
+                    if not api.user.has_permission(perm):
                         if request.headers.get(
                                 'X-Requested-With') == 'XMLHttpRequest':
                             return HTTPError(403, "Forbidden")
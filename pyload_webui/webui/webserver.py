@@ -12,6 +12,8 @@ from future import standard_library
 from pyload.utils.layer.safethreading import Event, Thread
 
 from . import iface
+from .metrics import registry
+from .sessions import Sweeper
 
 standard_library.install_aliases()
 
@@ -64,6 +66,12 @@ class WebServer(Thread):
                 log.warning(self._("SSL certificates not found"))
                 self.https = False
 
+        # remove expired sessions in background
+        Sweeper(iface.session_store, iface.SESSION_TIMEOUT).start()
+
+        if iface.SAMPLER:
+            iface.sampler.start()
+
         if iface.UNAVAILALBE:
             log.warning(self._("WebUI built is not available"))
         elif iface.APPDIR.endswith('app'):
@@ -72,7 +80,10 @@ class WebServer(Thread):
         prefer = None
 
         # These cases covers all settings
-        if self.server == "threaded":
+        if iface.PROCESSES > 1 and iface.API is not None and \
+                os.name == 'posix':
+            prefer = "prefork"
+        elif self.server == "threaded":
             prefer = "threaded"
         elif self.server == "fastcgi":
             prefer = "flup"
@@ -149,9 +160,18 @@ class WebServer(Thread):
                 # TODO: check for openSSL ?
 
             # Now instantiate the serverAdapter
-            server = server(self.host, self.port, self.key,
-                            self.cert, 6, self.debug)  # todo, num_connections
+            server = server(self.host, self.port, self.key, self.cert,
+                            iface.WORKERS, self.debug,
+                            max_connections=iface.WORKERS_MAX,
+                            idle_time=iface.WORKERS_IDLE_TIME,
+                            processes=iface.PROCESSES)
             name = server.NAME
+            # used to adapt the response compression to the load
+            iface.load.capacity = server.connection
+            server.on_resize = self.on_resize
+            registry.gauge('workers_idle', lambda: server.stats()['idle'])
+            registry.gauge(
+                'requests_queued', lambda: server.stats()['queued'])
 
         else:  # server is just a string
             name = server
@@ -160,6 +180,10 @@ class WebServer(Thread):
             name, self.host, self.port))
         iface.run_server(host=self.host, port=self.port, server=server)
 
+    def on_resize(self, workers):
+        iface.load.capacity = workers
+        log.debug("Webserver pool resized to {0:d} workers".format(workers))
+
     # check if an error was raised for n seconds
     def check_error(self, n=1):
         threshold = time.time() + n
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Zip archives of files on disk generated while they are sent: the files are
+stored uncompressed, so the size of the archive is known before the first
+byte is read, and their checksums follow them in data descriptors.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import posixpath
+import struct
+import time
+import zlib
+from builtins import int, object
+
+from future import standard_library
+
+standard_library.install_aliases()
+
+# size of the blocks read from the files
+CHUNK_SIZE = 64 << 10
+
+# sizes, offsets and counts over these need the zip64 extensions
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+# version needed to extract, 2.0 or 4.5 with zip64
+VERSION = 20
+VERSION_ZIP64 = 45
+
+# sizes and checksum in a data descriptor, utf-8 names
+FLAGS = 0x08 | 0x800
+
+# regular file readable by everyone, in the unix attributes
+EXTERNAL_ATTR = 0o100644 << 16
+# made by unix, so the attributes apply
+MADE_BY = 3 << 8
+
+_LOCAL = struct.Struct(b"<IHHHHHIIIHH")
+_CENTRAL = struct.Struct(b"<IHHHHHHIIIHHHHHII")
+_DESCRIPTOR = struct.Struct(b"<IIII")
+_DESCRIPTOR64 = struct.Struct(b"<IIQQ")
+_END = struct.Struct(b"<IHHHHIIH")
+_END64 = struct.Struct(b"<IQHHIIQQQQ")
+_LOCATOR64 = struct.Struct(b"<IIQI")
+
+
+def _dos_datetime(mtime):
+    t = time.localtime(mtime)
+    # the range of the format
+    year = min(max(t.tm_year, 1980), 2107)
+    if year != t.tm_year:
+        return (year - 1980) << 9 | 1 << 5 | 1, 0
+    date = (year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    clock = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return date, clock
+
+
+def archive_name(filename, names):
+    """
+    Name of `filename` in an archive already holding `names`, relative
+    and unique
+    """
+    parts = [part for part in filename.replace("\\", "/").split("/")
+             if part not in ("", ".", "..")]
+    name = "/".join(parts) or "file"
+    base, ext = posixpath.splitext(name)
+    count = 1
+    while name in names:
+        name = "{0} ({1:d}){2}".format(base, count, ext)
+        count += 1
+    return name
+
+
+class ZipEntry(object):
+
+    __slots__ = ['crc', 'date', 'name', 'offset', 'path', 'size', 'time']
+
+    def __init__(self, name, path, size, mtime):
+        self.name = name.encode('utf-8')
+        self.path = path
+        self.size = size
+        self.date, self.time = _dos_datetime(mtime)
+        self.offset = 0
+        self.crc = 0
+
+    @property
+    def zip64(self):
+        return self.size >= ZIP64_LIMIT
+
+    def local_header(self):
+        extra = b""
+        size = 0
+        if self.zip64:
+            # the sizes are in the descriptor, here they only tell its format
+            extra = struct.pack(b"<HHQQ", 1, 16, 0, 0)
+            size = ZIP64_LIMIT
+        return _LOCAL.pack(
+            0x04034b50, VERSION_ZIP64 if self.zip64 else VERSION, FLAGS, 0,
+            self.time, self.date, 0, size, size, len(self.name),
+            len(extra)) + self.name + extra
+
+    def descriptor(self):
+        if self.zip64:
+            return _DESCRIPTOR64.pack(
+                0x08074b50, self.crc, self.size, self.size)
+        return _DESCRIPTOR.pack(0x08074b50, self.crc, self.size, self.size)
+
+    def central_header(self):
+        fields = []
+        size = offset = None
+        if self.size >= ZIP64_LIMIT:
+            fields.extend([self.size, self.size])
+            size = ZIP64_LIMIT
+        if self.offset >= ZIP64_LIMIT:
+            fields.append(self.offset)
+            offset = ZIP64_LIMIT
+        extra = b""
+        if fields:
+            extra = struct.pack(b"<HH", 1, 8 * len(fields)) + struct.pack(
+                "<{0:d}Q".format(len(fields)).encode('ascii'), *fields)
+        version = VERSION_ZIP64 if fields else VERSION
+        return _CENTRAL.pack(
+            0x02014b50, MADE_BY | version, version, FLAGS, 0, self.time,
+            self.date, self.crc, self.size if size is None else size,
+            self.size if size is None else size, len(self.name), len(extra),
+            0, 0, 0, EXTERNAL_ATTR,
+            self.offset if offset is None else offset) + self.name + extra
+
+
+class ZipStream(object):
+    """
+    Iterable over the bytes of a zip archive of `files`, reading them in
+    blocks of `chunk_size`; `length` is its size in bytes.
+
+    :param files: list of the name in the archive, path, size and mtime of
+        each file; files changing size while read break the archive
+    """
+    def __init__(self, files, chunk_size=CHUNK_SIZE):
+        self.entries = [ZipEntry(*args) for args in files]
+        self.chunk_size = chunk_size
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            offset += len(entry.local_header()) + entry.size + \
+                len(entry.descriptor())
+        # where the central directory starts and its size, which the
+        # checksums don't change
+        self.start = offset
+        self.central_size = sum(
+            len(entry.central_header()) for entry in self.entries)
+        self.length = self.start + self.central_size + len(
+            self.end(self.start, self.central_size))
+
+    def end(self, start, size):
+        """
+        Records ending the archive, which has its central directory of
+        `size` bytes at `start`
+        """
+        count = len(self.entries)
+        records = b""
+        if count >= ZIP64_COUNT_LIMIT or start >= ZIP64_LIMIT or \
+                size >= ZIP64_LIMIT:
+            records = _END64.pack(
+                0x06064b50, _END64.size - 12, VERSION_ZIP64, VERSION_ZIP64,
+                0, 0, count, count, size, start) + _LOCATOR64.pack(
+                0x07064b50, 0, start + size, 1)
+            count = min(count, ZIP64_COUNT_LIMIT)
+            start = min(start, ZIP64_LIMIT)
+            size = min(size, ZIP64_LIMIT)
+        return records + _END.pack(
+            0x06054b50, 0, 0, count, count, size, start, 0)
+
+    def _read_entry(self, entry):
+        remaining = entry.size
+        crc = 0
+        with open(entry.path, 'rb') as fp:
+            while remaining > 0:
+                data = fp.read(min(self.chunk_size, remaining))
+                if not data:
+                    raise IOError("File changed while sending: {0}".format(
+                        entry.path))
+                crc = zlib.crc32(data, crc)
+                remaining -= len(data)
+                yield data
+        entry.crc = crc & 0xFFFFFFFF
+
+    def __iter__(self):
+        for entry in self.entries:
+            yield entry.local_header()
+            for data in self._read_entry(entry):
+                yield data
+            yield entry.descriptor()
+        yield b"".join(entry.central_header() for entry in self.entries)
+        yield self.end(self.start, self.central_size)
@@ -13,10 +13,17 @@
 from __future__ import absolute_import
 
 import codecs
+import distutils.log
+import gzip
+import hashlib
+import io
+import json
 import os
+import posixpath
 import re
 import shutil
 import subprocess
+import time
 
 from itertools import chain
 
@@ -107,6 +114,191 @@ class BuildNode(Command):
             shell=True)
             
             
+class BuildAssets(Command):
+    """
+    Fingerprint and precompress the built webui
+    """
+    description = 'fingerprint and precompress the webui files'
+    user_options = [('dist-dir=', 'd', "built webui directory")]
+
+    MANIFEST = 'manifest.json'
+
+    # text formats worth compressing, the others are compressed already
+    COMPRESSIBLE = ('.css', '.eot', '.htm', '.html', '.ico', '.js', '.json',
+                    '.map', '.otf', '.svg', '.ttf', '.txt', '.xml')
+
+    # names of the files already fingerprinted by `grunt rev`
+    _RE_REVVED = re.compile(r'^[0-9a-f]{8}\.')
+    _RE_HTML_REF = re.compile(r'(\b(?:src|href)=["\'])([^"\'?#]+)')
+    _RE_CSS_REF = re.compile(r'(\burl\(\s*["\']?)([^"\')?#]+)')
+
+    def initialize_options(self):
+        self.dist_dir = None
+
+    def finalize_options(self):
+        if self.dist_dir is None:
+            self.dist_dir = os.path.join('pyload', 'webui', 'min')
+
+    def run(self):
+        if not os.path.isfile(os.path.join(self.dist_dir, 'index.html')):
+            distutils.log.warn("No webui build to fingerprint")
+            return
+        self.clean()
+
+        names = []
+        for dirpath, dirnames, filenames in os.walk(self.dist_dir):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                names.append(
+                    os.path.relpath(path, self.dist_dir).replace(os.sep, '/'))
+
+        # stylesheets reference other files, so they are renamed after them
+        fingerprints = {}
+        for name in sorted(names, key=lambda x: x.endswith('.css')):
+            if name.endswith('.html'):
+                continue
+            if name.endswith('.css'):
+                self.rewrite(name, self._RE_CSS_REF, fingerprints)
+            fingerprints[name] = self.fingerprint(name)
+        for name in names:
+            if name.endswith('.html'):
+                self.rewrite(name, self._RE_HTML_REF, fingerprints)
+
+        assets = {}
+        for name in set(names) | set(fingerprints.values()):
+            data = self.read(name)
+            assets[name] = {
+                'sha1': hashlib.sha1(data).hexdigest(),
+                'size': len(data),
+                'encodings': self.compress(name, data),
+                'immutable': name in fingerprints.values()}
+
+        manifest = {
+            'version': 1,
+            'mtime': int(time.time()),
+            'assets': assets,
+            'fingerprints': dict(
+                (name, fingerprinted)
+                for name, fingerprinted in fingerprints.items()
+                if name != fingerprinted)}
+        with open(os.path.join(self.dist_dir, self.MANIFEST), 'w') as fp:
+            json.dump(manifest, fp, indent=1, sort_keys=True)
+
+    def path(self, name):
+        return os.path.join(self.dist_dir, *name.split('/'))
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as fp:
+            return fp.read()
+
+    def write(self, name, data):
+        with open(self.path(name), 'wb') as fp:
+            fp.write(data)
+
+    def clean(self):
+        """
+        Remove the files written by a previous run
+        """
+        path = os.path.join(self.dist_dir, self.MANIFEST)
+        if not os.path.isfile(path):
+            return
+        with open(path) as fp:
+            manifest = json.load(fp)
+        generated = list(manifest['fingerprints'].values())
+        for name, asset in manifest['assets'].items():
+            generated.extend(name + variant['ext']
+                             for variant in asset['encodings'].values())
+        for name in generated + [self.MANIFEST]:
+            if os.path.isfile(self.path(name)):
+                os.remove(self.path(name))
+
+    def fingerprint(self, name):
+        """
+        Copy `name` to a name containing a hash of its content
+
+        :return: the new name
+        """
+        dirname, filename = posixpath.split(name)
+        if self._RE_REVVED.match(filename):
+            return name
+        data = self.read(name)
+        base, ext = posixpath.splitext(filename)
+        fingerprinted = posixpath.join(dirname, '{0}.{1}{2}'.format(
+            base, hashlib.sha1(data).hexdigest()[:10], ext))
+        # the original is kept for the references which are not rewritten
+        self.write(fingerprinted, data)
+        return fingerprinted
+
+    def rewrite(self, name, pattern, fingerprints):
+        """
+        Point the references in `name` to the fingerprinted files
+        """
+        dirname = posixpath.dirname(name)
+
+        def replace(match):
+            ref = match.group(2).strip()
+            if '//' in ref or ref.startswith('data:'):
+                return match.group(0)
+            if ref.startswith('/'):
+                target = posixpath.normpath(ref.lstrip('/'))
+            else:
+                target = posixpath.normpath(posixpath.join(dirname, ref))
+            fingerprinted = fingerprints.get(target)
+            if fingerprinted is None or fingerprinted == target:
+                return match.group(0)
+            if ref.startswith('/'):
+                return match.group(1) + '/' + fingerprinted
+            return match.group(1) + posixpath.relpath(
+                fingerprinted, dirname or '.')
+
+        text = self.read(name).decode('utf-8')
+        self.write(name, pattern.sub(replace, text).encode('utf-8'))
+
+    def compress(self, name, data):
+        """
+        Write the precompressed variants of `name`, the ones not smaller
+        than the original are left out
+
+        :return: dict of the extension and size of the files written, by
+            encoding
+        """
+        if not name.lower().endswith(self.COMPRESSIBLE):
+            return {}
+        encodings = {}
+        for encoding, ext, func in self.compressors():
+            compressed = func(data)
+            if len(compressed) < len(data):
+                self.write(name + ext, compressed)
+                encodings[encoding] = {'ext': ext, 'size': len(compressed)}
+        return encodings
+
+    @staticmethod
+    def compressors():
+        def gzip_compress(data):
+            buf = io.BytesIO()
+            # no timestamp, to get the same output on every build
+            fp = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9,
+                               mtime=0)
+            fp.write(data)
+            fp.close()
+            return buf.getvalue()
+
+        compressors = [('gzip', '.gz', gzip_compress)]
+        try:
+            import brotli
+            compressors.append(
+                ('br', '.br', lambda data: brotli.compress(data, quality=11)))
+        except ImportError:
+            pass
+        try:
+            import zstandard
+            compressors.append(
+                ('zstd', '.zst', zstandard.ZstdCompressor(level=19).compress))
+        except ImportError:
+            pass
+        return compressors
+
+
 # class DownloadCatalog(Command):
 # """
 # Download the translation catalog from the remote repository
@@ -131,6 +323,7 @@ class BdistEgg(bdist_egg):
     def run(self):
         if not self.dry_run:
             self.run_command('build_node')
+            self.run_command('build_assets')
             # self.run_command('build_locale')
         bdist_egg.run(self)
 
@@ -142,6 +335,7 @@ class BuildPy(build_py):
     def run(self):
         if not self.dry_run:
             self.run_command('build_node')
+            self.run_command('build_assets')
             # self.run_command('build_locale')
         build_py.run(self)
 
@@ -193,6 +387,7 @@ setup(
     python_requires='>=2.6,!=3.0,!=3.1,!=3.2',
     cmdclass={
         'bdist_egg': BdistEgg,
+        'build_assets': BuildAssets,
         # 'build_locale': BuildLocale,
         'build_node': BuildNode,
         'build_py': BuildPy,
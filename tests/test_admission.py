@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import unittest
+from wsgiref.util import setup_testing_defaults
+
+from future import standard_library
+
+from bottle import Bottle
+from pyload_webui.webui.admission import AdmissionControl
+
+standard_library.install_aliases()
+
+
+class TestHeldBody(unittest.TestCase):
+    """
+    Slots held for streamed bodies are released however the body ends
+    """
+    def setUp(self):
+        self.admission = AdmissionControl(1)
+        self.app = Bottle()
+        self.app.catchall = True
+
+    def call(self, body):
+        @self.app.route("/")
+        def index():
+            return self.admission.hold(body, self.admission.acquire())
+
+        environ = {}
+        setup_testing_defaults(environ)
+        result = self.app(environ, lambda status, headers, exc_info=None:
+                          None)
+        data = b"".join(result)
+        if hasattr(result, 'close'):
+            result.close()
+        return data
+
+    def test_sent(self):
+        self.assertEqual(self.call(x for x in [b"a", b"b"]), b"ab")
+        self.assertEqual(self.admission.active, 0)
+
+    def test_empty(self):
+        self.call(x for x in [])
+        self.assertEqual(self.admission.active, 0)
+
+    def test_first_chunk_fails(self):
+        def body():
+            raise ValueError("failed")
+            yield b""
+        self.call(body())
+        self.assertEqual(self.admission.active, 0)
+
+    def test_released_once(self):
+        self.call(x for x in [b"a"])
+        self.admission.acquire()
+        self.assertEqual(self.admission.active, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
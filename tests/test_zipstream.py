@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+from builtins import range
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+from future import standard_library
+
+from bottle import Bottle, HTTPResponse
+from pyload_webui.webui.bandwidth import Throttle
+from pyload_webui.webui.zipstream import ZipStream
+
+standard_library.install_aliases()
+
+import http.client  # noqa: E402
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class TestZipStream(unittest.TestCase):
+    """
+    Package archives served like `download_package`, by a server handing
+    file-like bodies to its `wsgi.file_wrapper`
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(3):
+            path = os.path.join(self.tmpdir, "file{0:d}.bin".format(i))
+            with open(path, 'wb') as fp:
+                fp.write(os.urandom(100000 * (i + 1)))
+            st = os.stat(path)
+            self.files.append(("file{0:d}.bin".format(i), path,
+                               st.st_size, st.st_mtime))
+        self.throttle = None
+
+        app = Bottle()
+
+        @app.route("/download/package/<pid>")
+        def download_package(pid):
+            archive = ZipStream(self.files)
+            resp = HTTPResponse(archive, **{
+                'Content-Type': "application/zip",
+                'Content-Length': str(archive.length)})
+            if self.throttle is not None:
+                resp = self.throttle.wrap(resp, 1)
+            return resp
+
+        self.server = make_server("127.0.0.1", 0, app,
+                                  handler_class=QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def fetch(self):
+        conn = http.client.HTTPConnection(
+            "127.0.0.1", self.server.server_port, timeout=10)
+        try:
+            conn.request('GET', "/download/package/1")
+            resp = conn.getresponse()
+            return resp, resp.read()
+        finally:
+            conn.close()
+
+    def check(self, resp, data):
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(int(resp.getheader('Content-Length')), len(data))
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        for name, path, size, mtime in self.files:
+            with open(path, 'rb') as fp:
+                self.assertEqual(archive.read(name), fp.read())
+
+    def test_file_wrapper(self):
+        self.check(*self.fetch())
+
+    def test_throttled(self):
+        self.throttle = Throttle(limit=100 << 20)
+        self.check(*self.fetch())
+
+
+if __name__ == '__main__':
+    unittest.main()